@@ -0,0 +1,350 @@
+# Benchmarks for the scrape -> store -> search -> render pipeline
+#
+# Builds synthetic copies of episodes.db at several sizes (1x is the real data, larger sizes add
+# copies of every show's seasons with shuffled plot text), then times the app's hot paths on each
+# and writes latency percentiles and peak memory to a JSON file that later runs can be compared to.
+#
+#   python benchmark.py                                  # 1x, 10x and 100x -> bench_results.json
+#   python benchmark.py --scales 1 10 --out after.json --compare bench_results.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import db
+from schema import create_schema
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "seasons")
+
+SEARCH_QUERIES = ["wedding", "peter gets a job", "homer marriage trouble", "cartman", "christmas special"]
+
+COLUMNS = ['show', 'season', 'episode', 'episode_title', 'air_date', 'rating', 'votes', 'plot', 'image']
+
+
+def log(message):
+    print(message, flush=True)
+
+
+# a copy of the source database brought up to the current schema (ISO dates, exact votes)
+def migrated_source(source_db, workdir):
+    path = os.path.join(workdir, "source.db")
+    if not os.path.exists(path):
+        shutil.copyfile(source_db, path)
+        create_schema(path)
+    return path
+
+
+# a database with `scale` copies of every episode; copy k > 0 is shifted to seasons k*100 and up
+# and has its plot words shuffled, so the vocabulary stays realistic but the documents differ
+def build_synthetic_db(source_db, workdir, scale, seed=0):
+    path = os.path.join(workdir, f"episodes_{scale}x.db")
+    source = sqlite3.connect(migrated_source(source_db, workdir))
+    rows = source.execute(f"SELECT {', '.join(COLUMNS)} FROM episodes ORDER BY id").fetchall()
+    source.close()
+
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        count = conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+        conn.close()
+        if count == len(rows) * scale:
+            return path
+        os.remove(path)
+
+    create_schema(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    with conn:
+        for copy in range(scale):
+            batch = []
+            for show, season, episode, title, air_date, rating, votes, plot, image in rows:
+                if copy:
+                    words = (plot or '').split()
+                    rng.shuffle(words)
+                    plot = " ".join(words)
+                batch.append((show, season + copy * 100, episode, title, air_date, rating, votes, plot, image))
+            conn.executemany(
+                f"INSERT INTO episodes ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", batch
+            )
+    conn.execute("ANALYZE")
+    conn.close()
+    log(f"Built {path} with {len(rows) * scale} episodes")
+    return path
+
+
+def percentile_stats(timings):
+    timings = np.array(timings) * 1000
+    return {
+        "runs": len(timings),
+        "mean_ms": round(float(timings.mean()), 3),
+        "min_ms": round(float(timings.min()), 3),
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p90_ms": round(float(np.percentile(timings, 90)), 3),
+        "p99_ms": round(float(np.percentile(timings, 99)), 3),
+        "max_ms": round(float(timings.max()), 3),
+    }
+
+
+# time fn(i) for up to `repeat` runs (at least 3, stopping early after `budget` seconds),
+# then run it once more under tracemalloc for the peak memory, which tracing would distort
+def measure(fn, repeat, budget):
+    timings = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+        if i >= 2 and time.perf_counter() - started > budget:
+            break
+
+    tracemalloc.start()
+    fn(len(timings))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = percentile_stats(timings)
+    stats["peak_memory_kb"] = round(peak / 1024, 1)
+    return stats
+
+
+def timed_once(fn):
+    start = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def load_fixture_pages():
+    pages = []
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+                pages.append((name, f.read()))
+    return pages
+
+
+# every benchmark for one database; the app's caches are cleared before each run so it is timed cold
+def run_scale(db_file, repeat, budget, seed=0):
+    import ui
+    from imdb_scrape import save_episodes
+    from season_parser import parse_episodes_from_markup, parse_season_page
+    from search_index import build_index
+    from similar_episodes import fetch_similar_episodes, refresh_similar_episodes
+    from snapshot import export_snapshot, load_frame
+    from episode_query import build_filters, count_episodes
+    from episode_stats import get_episode_stats, refresh_episode_stats
+
+    db.configure(db_file)
+    rng = random.Random(seed)
+    with db.connection() as conn:
+        episodes = [dict(row) for row in conn.execute("SELECT id, show, plot FROM episodes")]
+    samples = rng.sample(episodes, min(len(episodes), 50))
+    sample_ids = [episode['id'] for episode in samples]
+
+    def clear_caches():
+        ui.results_cache.clear()
+        ui.card_cache.clear()
+
+    results = {"episodes": len(episodes), "setup": {}}
+    # one-off costs, paid after a scrape rather than per request
+    results["setup"]["build_search_index_ms"] = timed_once(lambda: build_index(db_file))
+    results["setup"]["refresh_similar_episodes_ms"] = timed_once(lambda: refresh_similar_episodes(db_file))
+    # loads the index that was just built
+    results["setup"]["load_search_index_ms"] = timed_once(lambda: ui.get_search_index(db_file))
+    results["setup"]["export_snapshot_ms"] = timed_once(lambda: export_snapshot(db_file, force=True))
+    results["setup"]["refresh_episode_stats_ms"] = timed_once(lambda: refresh_episode_stats(db_file, force=True))
+
+    def fetch_all(i):
+        ui.fetch_data_from_db()
+
+    def fetch_show(i):
+        ui.fetch_data_from_db("show = ?", (samples[i % len(samples)]['show'],))
+
+    # the columns a rating/votes analysis needs, from SQLite and from the columnar snapshot
+    def ratings_sql(i):
+        with db.connection() as conn:
+            pd.read_sql_query("SELECT show, season, rating, votes FROM episodes", conn)
+
+    def ratings_snapshot(i):
+        load_frame(['show', 'season', 'rating', 'votes'], db_file=db_file)
+
+    # the pager total and show counts for a show + min rating filter, from SQLite and from the summary
+    def filtered_count(i):
+        episode = samples[i % len(samples)]
+        count_episodes(*build_filters(episode['show'], filter_rating=7))
+
+    def filtered_count_stats(i):
+        episode = samples[i % len(samples)]
+        get_episode_stats(db_file).count(episode['show'], None, None, 7)
+
+    def browse_page(i):
+        clear_caches()
+        ui.update_results(None, None, None, None, None, 1 + i % 5, None)
+
+    def search(i):
+        clear_caches()
+        ui.update_results(SEARCH_QUERIES[i % len(SEARCH_QUERIES)], None, None, None, None, 1, None)
+
+    def search_filtered(i):
+        clear_caches()
+        episode = samples[i % len(samples)]
+        ui.update_results(SEARCH_QUERIES[i % len(SEARCH_QUERIES)], episode['show'], None, None, 7, 1, None)
+
+    def find_similar(i):
+        episode = samples[i % len(samples)]
+        ui.find_similar_plots(db_file, episode['plot'], episode['show'], episode['id'])
+
+    def similar_lookup(i):
+        start = (i * ui.RESULTS_PER_PAGE) % len(sample_ids)
+        fetch_similar_episodes(sample_ids[start:start + ui.RESULTS_PER_PAGE])
+
+    rows = ui.fetch_episodes_by_ids(sample_ids)
+    for row in rows:
+        row['votes'] = ui.format_votes(row['votes'])
+
+    def render_card(i):
+        ui.create_episode_card(rows[i % len(rows)])
+
+    def render_page(i):
+        clear_caches()
+        start = (i * ui.RESULTS_PER_PAGE) % len(sample_ids)
+        ui.render_cards(sample_ids[start:start + ui.RESULTS_PER_PAGE], -1)
+
+    pages = load_fixture_pages()
+
+    def parse_page(i):
+        parse_season_page(pages[i % len(pages)][1])
+
+    # the fallback for pages without the embedded JSON, which parse_season_page never reaches here
+    def parse_markup(i):
+        parse_episodes_from_markup(pages[i % len(pages)][1])
+
+    parsed = [parse_season_page(page) for _, page in pages]
+
+    # new rows under a new show name each run, so every run inserts instead of finding nothing changed
+    def insert_season(i):
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_episodes(db_file, f"Benchmark Show {i}", parsed[i % len(parsed)])
+
+    benchmarks = [
+        ("fetch_data_from_db", fetch_all),
+        ("fetch_data_from_db_show", fetch_show),
+        ("ratings_read_sql", ratings_sql),
+        ("ratings_snapshot", ratings_snapshot),
+        ("filtered_count_sql", filtered_count),
+        ("filtered_count_stats", filtered_count_stats),
+        ("browse_page", browse_page),
+        (f"search_{ui.SEARCH_BACKEND}", search),
+        (f"search_{ui.SEARCH_BACKEND}_filtered", search_filtered),
+        ("find_similar_plots", find_similar),
+        ("similar_episodes_lookup", similar_lookup),
+        ("create_episode_card", render_card),
+        ("render_page_cold", render_page),
+    ]
+    if pages:
+        benchmarks += [
+            ("parse_season_page", parse_page),
+            ("parse_episodes_from_markup", parse_markup),
+            ("save_episodes", insert_season),
+        ]
+
+    for name, fn in benchmarks:
+        results[name] = measure(fn, repeat, budget)
+        log(f"  {name:<32} p50 {results[name]['p50_ms']:>10.3f} ms   p90 {results[name]['p90_ms']:>10.3f} ms"
+            f"   peak {results[name]['peak_memory_kb']:>10.1f} KB")
+
+    # leave the database as it was, so the next run times the same data
+    with sqlite3.connect(db_file) as write_conn:
+        write_conn.execute("DELETE FROM episodes WHERE show LIKE 'Benchmark Show %'")
+        write_conn.execute("DELETE FROM crawl_state WHERE show LIKE 'Benchmark Show %'")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# p50 of this run relative to an earlier one, per scale and benchmark
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    log(f"\nCompared to {baseline_file} ({baseline.get('commit')}), p50 new / old:")
+    for scale, benchmarks in results["scales"].items():
+        old_benchmarks = baseline["scales"].get(scale, {})
+        for name, stats in benchmarks.items():
+            old = old_benchmarks.get(name)
+            if not isinstance(stats, dict) or "p50_ms" not in stats or not old or not old.get("p50_ms"):
+                continue
+            log(f"  {scale:>5} {name:<32} {stats['p50_ms'] / old['p50_ms']:>6.2f}x")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the episode scraper, search and UI.")
+    parser.add_argument("--source", default="episodes.db", help="the database the synthetic ones are built from")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="sizes to benchmark, as multiples of the source database")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per benchmark")
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="stop a benchmark after this many seconds (it still gets at least 3 runs)")
+    parser.add_argument("--workdir", help="keep the synthetic databases here and reuse them (default: a temp dir)")
+    parser.add_argument("--backend", help="search backend to benchmark (default: EPISODES_SEARCH_BACKEND)")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="episodes_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    db_files = {scale: build_synthetic_db(args.source, workdir, scale) for scale in args.scales}
+
+    # the app sets itself up against DB_FILE when it is imported
+    db.configure(db_files[args.scales[0]])
+    import ui
+    if args.backend:
+        ui.SEARCH_BACKEND = args.backend
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "search_backend": ui.SEARCH_BACKEND,
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    for scale, db_file in db_files.items():
+        log(f"\n{scale}x ({db_file})")
+        results["scales"][f"{scale}x"] = run_scale(db_file, args.repeat, args.budget)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    log(f"\nWrote {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+    if not args.workdir:
+        db.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+
+# the one place that decides which database the app reads
+DB_FILE = os.environ.get("EPISODES_DB", "episodes.db")
+
+# read tuning: map up to 256 MB of the file into memory and keep a 64 MB page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 64 * 1024
+# prepared statements kept per connection; the app only issues a few dozen distinct queries
+CACHED_STATEMENTS = 256
+# idle connections kept open per database
+POOL_SIZE = 8
+
+
+def configure(db_file):
+    global DB_FILE
+    DB_FILE = db_file
+
+
+# read-only connections to one database, checked out for one query or callback and then returned
+#
+# Dash's threaded server may run every request on a new thread, so connections are not tied to
+# threads: up to POOL_SIZE idle connections are kept open and reused by whichever thread needs one.
+# Under more concurrent load than that, extra connections are opened and closed again when returned.
+# The database is in WAL mode (see schema.py), so these readers never block the scraper and are
+# never blocked by it.
+class ReadOnlyPool:
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        path = os.path.abspath(self.db_file)
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, cached_statements=CACHED_STATEMENTS, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# a read-only connection to db_file (default: DB_FILE), e.g. `with db.connection() as conn:`;
+# rows have to be fetched before the block ends, since the connection goes back to the pool
+def connection(db_file=None):
+    db_file = db_file or DB_FILE
+    pool = _pools.get(db_file)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_file, ReadOnlyPool(db_file))
+    return pool.connection()
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
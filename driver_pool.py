@@ -0,0 +1,110 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+
+# the headless Chrome the scraper has always used
+def create_driver():
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument(f"user-agent={USER_AGENT}")
+    return webdriver.Chrome(options=options)
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+# a fixed set of browsers that are started once and handed out to season jobs
+#
+#   with DriverPool(size=2) as pool:
+#       with pool.driver() as driver:
+#           driver.get(url)
+#
+# a browser is restarted after it crashes or after max_pages pages (Chrome leaks memory over time)
+class DriverPool:
+    def __init__(self, size=1, max_pages=50, driver_factory=create_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+        # LIFO so a warm browser is reused before another one is started
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # one slot per browser; None means the browser has not been started (yet, or again)
+        for _ in range(size):
+            self._idle.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self):
+        pooled = _PooledDriver(self.driver_factory())
+        with self._lock:
+            self._all.append(pooled)
+        return pooled
+
+    def _stop(self, pooled):
+        with self._lock:
+            if pooled in self._all:
+                self._all.remove(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        if self._closed:
+            raise RuntimeError("DriverPool is closed")
+        pooled = self._idle.get()
+        if pooled is None:
+            try:
+                pooled = self._start()
+            except Exception:
+                self._idle.put(None)
+                raise
+        return pooled
+
+    def _release(self, pooled, broken=False):
+        pooled.pages += 1
+        if broken or pooled.pages >= self.max_pages or self._closed:
+            self._stop(pooled)
+            self._idle.put(None)
+        else:
+            self._idle.put(pooled)
+
+    # borrow a browser for one page; a crashed browser is replaced, a slow page is not a crash
+    @contextmanager
+    def driver(self):
+        pooled = self._acquire()
+        broken = False
+        try:
+            yield pooled.driver
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self._release(pooled, broken)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            drivers = list(self._all)
+        for pooled in drivers:
+            self._stop(pooled)
+        print(f"Closed {len(drivers)} browser(s)")
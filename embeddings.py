@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import pickle
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import db
+import search_index
+from search_index import current_version, get_search_index, new_version_dir, publish_version
+
+# size of the dense vectors (LSA topics) every episode is encoded into
+EMBEDDING_DIM = 128
+# inverted lists probed per query: higher finds more of the true neighbors, lower is faster
+NPROBE = int(os.environ.get("EPISODES_NPROBE", "8"))
+
+
+# the embeddings live next to the search index, e.g. episodes.db -> episodes_embeddings/
+def default_embeddings_dir(db_file):
+    return os.path.splitext(db_file)[0] + "_embeddings"
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+# dense episode vectors with an IVF (inverted file) index over them
+#
+# the vectors are LSA topics of the TF-IDF matrix, so "wedding" and "marriage" end up close even
+# when two plots share no word. Episodes are clustered into lists around centroids and stored list
+# by list; a query only scores the episodes in the `nprobe` lists whose centroids are closest.
+# Each version keeps a copy of the vectorizer it was built with, so it never depends on which
+# version of the search index is current.
+class EmbeddingIndex:
+    def __init__(self, vectorizer, ids, vectors, components, centroids, list_offsets, signature,
+                 db_file, version, nprobe=NPROBE):
+        self.vectorizer = vectorizer
+        self.ids = ids
+        self.vectors = vectors
+        self.components = components
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.signature = signature
+        self.db_file = db_file
+        self.version = version
+        self.nprobe = nprobe
+        self.checked_at = time.time()
+        self.rows_by_id = {int(episode_id): row for row, episode_id in enumerate(ids)}
+
+    # the unit vector of free text, in the same space as the episodes
+    def encode(self, text):
+        query_vec = self.vectorizer.transform([text])
+        return _normalize(np.asarray(query_vec @ self.components.T))[0]
+
+    def vector(self, episode_id):
+        return self.vectors[self.rows_by_id[int(episode_id)]]
+
+    # the rows of the lists whose centroids are closest to the vector
+    def probe(self, vector, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        return np.concatenate([
+            np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists
+        ])
+
+    # (rows, mask) of some episode ids, to restrict searches to them; computed once for a set of
+    # ids that many searches share, e.g. every episode of a show
+    def subset(self, ids):
+        rows = np.array([self.rows_by_id[i] for i in map(int, ids) if i in self.rows_by_id], dtype=np.int64)
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[rows] = True
+        return rows, mask
+
+    # episode ids closest to the vector, best first, optionally only among `ids` (or a `subset`)
+    def search(self, vector, k=None, ids=None, nprobe=None, subset=None):
+        if ids is not None:
+            subset = self.subset(ids)
+        if subset is not None:
+            rows, mask = subset
+            # a filter that leaves fewer episodes than a probe would scan is cheaper to score exactly
+            probed = self.probe(vector, nprobe)
+            if len(rows) > len(probed):
+                rows = probed[mask[probed]]
+        else:
+            rows = self.probe(vector, nprobe)
+
+        scores = self.vectors[rows] @ vector
+        order = np.argsort(-scores, kind='stable')[:k]
+        return self.ids[rows[order]], scores[order]
+
+    # same interface as SearchIndex.rank, but only episodes that are related at all are returned
+    def rank(self, query, ids=None):
+        vector = self.encode(query)
+        if not vector.any():
+            # no indexed word in the query
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        row_ids, scores = self.search(vector, ids=ids)
+        keep = scores > 0
+        return row_ids[keep], scores[keep]
+
+    # the k episodes most similar to an episode, optionally only among `ids` (or a `subset`)
+    def neighbors(self, episode_id, k, ids=None, subset=None):
+        row_ids, scores = self.search(self.vector(episode_id), k + 1, ids, subset=subset)
+        keep = row_ids != episode_id
+        return row_ids[keep][:k], scores[keep][:k]
+
+
+# encode every episode in the search index, cluster them into inverted lists and publish a new version
+def build_embeddings(db_file=None, embeddings_dir=None, dim=EMBEDDING_DIM):
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import TruncatedSVD
+
+    db_file = db_file or db.DB_FILE
+    embeddings_dir = embeddings_dir or default_embeddings_dir(db_file)
+    index = get_search_index(db_file)
+
+    matrix = index.matrix
+    dim = max(1, min(dim, matrix.shape[0] - 1, matrix.shape[1] - 1))
+    svd = TruncatedSVD(n_components=dim, random_state=0)
+    vectors = _normalize(svd.fit_transform(matrix))
+
+    # about sqrt(n) lists keeps both the centroid scan and each list short
+    n_lists = max(1, min(int(math.sqrt(len(vectors))), len(vectors)))
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=0, n_init=3, batch_size=1024)
+    assignments = kmeans.fit_predict(vectors)
+    centroids = _normalize(kmeans.cluster_centers_)
+
+    # store the vectors list by list, so probing a list reads one contiguous block
+    order = np.argsort(assignments, kind='stable')
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+
+    tmp_dir, version = new_version_dir(embeddings_dir)
+    np.save(os.path.join(tmp_dir, "ids.npy"), index.ids[order])
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors[order])
+    np.save(os.path.join(tmp_dir, "components.npy"), svd.components_.astype(np.float32))
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_dir, "list_offsets.npy"), list_offsets.astype(np.int64))
+    shutil.copyfile(
+        os.path.join(search_index.default_index_dir(db_file), index.version, "vectorizer.pkl"),
+        os.path.join(tmp_dir, "vectorizer.pkl")
+    )
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"signature": index.signature, "dim": dim, "lists": n_lists}, f)
+
+    publish_version(embeddings_dir, tmp_dir, version)
+    print(f"Built {dim}-dimensional embeddings for {len(vectors)} episodes in {n_lists} lists "
+          f"in {os.path.join(embeddings_dir, version)}")
+
+
+# Memory-map the current embeddings
+#
+# with rebuild_if_stale they are rebuilt first when missing or behind the search index; without it
+# (serving workers) the published version is used as it is, and only `serve.py --prepare` or the
+# scraper builds new ones
+def load_embeddings(db_file=None, embeddings_dir=None, rebuild_if_stale=True):
+    db_file = db_file or db.DB_FILE
+    embeddings_dir = embeddings_dir or default_embeddings_dir(db_file)
+
+    def read_meta():
+        version = current_version(embeddings_dir)
+        # versions from before the vectorizer was stored with them are rebuilt as well
+        if version is None or not os.path.exists(os.path.join(embeddings_dir, version, "vectorizer.pkl")):
+            return None, None
+        with open(os.path.join(embeddings_dir, version, "meta.json")) as f:
+            return version, json.load(f)
+
+    version, meta = read_meta()
+    if rebuild_if_stale and (meta is None or meta["signature"] != get_search_index(db_file).signature):
+        build_embeddings(db_file, embeddings_dir)
+        version, meta = read_meta()
+    if meta is None:
+        raise FileNotFoundError(
+            f"no embeddings published in {embeddings_dir}, run `python serve.py --prepare` "
+            "with EPISODES_SEARCH_BACKEND=semantic first"
+        )
+    version_dir = os.path.join(embeddings_dir, version)
+
+    def load(name):
+        return np.load(os.path.join(version_dir, name), mmap_mode='r')
+
+    with open(os.path.join(version_dir, "vectorizer.pkl"), "rb") as f:
+        vectorizer = pickle.load(f)
+
+    return EmbeddingIndex(
+        vectorizer,
+        np.asarray(load("ids.npy")),
+        load("vectors.npy"),
+        np.asarray(load("components.npy")),
+        np.asarray(load("centroids.npy")),
+        np.asarray(load("list_offsets.npy")),
+        meta["signature"],
+        db_file,
+        version
+    )
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+# the app's embeddings; like get_search_index, at most every INDEX_CHECK_INTERVAL seconds they
+# switch to a newly published version, or (with AUTO_REBUILD) rebuild when the search index changed,
+# one thread at a time
+def get_embedding_index(db_file=None):
+    global _embeddings
+    db_file = db_file or db.DB_FILE
+    embeddings = _embeddings
+    if (embeddings is not None and embeddings.db_file == db_file
+            and time.time() - embeddings.checked_at <= search_index.INDEX_CHECK_INTERVAL):
+        return embeddings
+    with _embeddings_lock:
+        if _embeddings is None or _embeddings.db_file != db_file:
+            _embeddings = load_embeddings(db_file, rebuild_if_stale=search_index.AUTO_REBUILD)
+        elif time.time() - _embeddings.checked_at > search_index.INDEX_CHECK_INTERVAL:
+            if current_version(default_embeddings_dir(db_file)) != _embeddings.version:
+                _embeddings = load_embeddings(db_file, rebuild_if_stale=False)
+            elif search_index.AUTO_REBUILD and get_search_index(db_file).signature != _embeddings.signature:
+                _embeddings = load_embeddings(db_file)
+            else:
+                _embeddings.checked_at = time.time()
+        return _embeddings
+
+
+if __name__ == "__main__":
+    build_embeddings()
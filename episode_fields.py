@@ -0,0 +1,53 @@
+import re
+from datetime import date, datetime
+
+# how IMDb prints air dates on season pages
+AIR_DATE_FORMATS = ["%a, %b %d, %Y", "%b %d, %Y"]
+
+
+# "Tue, Sep 21, 1999" -> "1999-09-21"; None when there is no full date (e.g. "N/A" or just a year)
+def parse_air_date(text):
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    for air_date_format in AIR_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, air_date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+# "1999-09-21" -> "Tue, Sep 21, 1999", the way the cards have always shown it
+def format_air_date(iso_date):
+    try:
+        aired = date.fromisoformat(iso_date)
+    except (TypeError, ValueError):
+        return iso_date or "N/A"
+    return f"{aired:%a}, {aired:%b} {aired.day}, {aired.year}"
+
+
+VOTES_PATTERN = re.compile(r"([\d.,]+)\s*([KM]?)", re.I)
+VOTE_MULTIPLIERS = {'': 1, 'K': 1000, 'M': 1000000}
+
+
+# "(4.7K)" -> 4700, "(1.2M)" -> 1200000, "(856)" -> 856
+def parse_votes(text):
+    match = VOTES_PATTERN.search(text or '')
+    if not match:
+        return None
+    number = float(match.group(1).replace(',', ''))
+    return int(round(number * VOTE_MULTIPLIERS[match.group(2).upper()]))
+
+
+# votes as older versions of the scraper stored them: "(4.7K)" became 4.7, "(11K)" became 11000
+# and "(47)" stayed 47, so only a fractional value is in thousands
+def legacy_votes(value):
+    if value is None:
+        return None
+    value = float(value)
+    return int(round(value * 1000)) if value != int(value) else int(value)
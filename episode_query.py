@@ -0,0 +1,86 @@
+import json
+
+from db import connection
+
+RESULTS_PER_PAGE = 10
+
+# the columns an episode card needs; the rest of the table is never read for browsing
+CARD_COLUMNS = ['id', 'show', 'season', 'episode', 'episode_title', 'air_date', 'rating', 'votes', 'plot', 'image']
+
+BROWSE_ORDER = "show, season, episode, id"
+
+
+# turn the UI filters into a WHERE clause and its parameters
+def build_filters(filter_show=None, start_date=None, end_date=None, filter_rating=None, filter_season=None):
+    filters = []
+    params = []
+
+    if filter_show:
+        filters.append("show = ?")
+        params.append(filter_show)
+
+    if start_date and end_date:
+        filters.append("air_date BETWEEN ? AND ?")
+        params += [start_date, end_date]
+
+    if filter_rating is not None:
+        filters.append("rating >= ?")
+        params.append(filter_rating)
+
+    if filter_season is not None:
+        filters.append("season = ?")
+        params.append(filter_season)
+
+    where_clause = " AND ".join(filters) if filters else None
+    return where_clause, params
+
+
+def _where(where_clause):
+    return f" WHERE {where_clause}" if where_clause else ""
+
+
+# number of episodes matching the filters, for the pager
+def count_episodes(where_clause=None, params=(), db_file=None):
+    with connection(db_file) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM episodes{_where(where_clause)}", params).fetchone()[0]
+
+
+# ids of every episode matching the filters, used as the candidate set for search
+def fetch_filtered_ids(where_clause=None, params=(), db_file=None):
+    with connection(db_file) as conn:
+        return [row[0] for row in conn.execute(f"SELECT id FROM episodes{_where(where_clause)}", params)]
+
+
+# one page of episodes in browsing order, sorted and sliced by SQLite
+def fetch_episode_page(where_clause=None, params=(), page=1, per_page=RESULTS_PER_PAGE,
+                       columns=CARD_COLUMNS, db_file=None):
+    query = f'''
+        SELECT {", ".join(columns)} FROM episodes{_where(where_clause)}
+        ORDER BY {BROWSE_ORDER}
+        LIMIT ? OFFSET ?
+    '''
+    with connection(db_file) as conn:
+        rows = conn.execute(query, [*params, per_page, (int(page) - 1) * per_page]).fetchall()
+    return [dict(row) for row in rows]
+
+
+# episodes by id, returned in the order of the given ids (e.g. a ranked search page)
+#
+# the ids are passed as one JSON array, so the statement text is the same for any number of ids
+# and SQLite's prepared statement is reused
+def fetch_episodes_by_ids(ids, columns=CARD_COLUMNS, db_file=None):
+    ids = [int(episode_id) for episode_id in ids]
+    if not ids:
+        return []
+
+    if 'id' not in columns:
+        columns = ['id', *columns]
+
+    with connection(db_file) as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(columns)} FROM episodes WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(ids),)
+        ).fetchall()
+
+    by_id = {row['id']: dict(row) for row in rows}
+    return [by_id[episode_id] for episode_id in ids if episode_id in by_id]
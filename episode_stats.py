@@ -0,0 +1,239 @@
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+
+import db
+from schema import get_data_version
+
+# width of the rating histogram buckets: 0.5 -> [0, 0.5), [0.5, 1), ... [10, 10.5)
+RATING_BUCKET = 0.5
+RATING_BUCKETS = int(10 / RATING_BUCKET) + 1
+
+# the episodes of one show and season that aired in one year, e.g. The Simpsons season 4 in 1993
+#
+# rating_histogram counts the rated episodes per RATING_BUCKET, so a "min rating" filter on a bucket
+# boundary (7, 7.5, 8...) can be counted without the episodes table
+StatsCell = namedtuple("StatsCell", [
+    "show", "season", "year", "episodes", "rated", "rating_sum", "min_rating", "max_rating", "votes",
+    "rating_histogram",
+])
+
+# one row per cell and rating bucket, folded into cells by aggregate_cells
+AGGREGATE_QUERY = f'''
+    SELECT show, season, CAST(substr(air_date, 1, 4) AS INTEGER),
+           CAST(rating / {RATING_BUCKET} AS INTEGER),
+           COUNT(*), COUNT(rating), TOTAL(rating), MIN(rating), MAX(rating), CAST(TOTAL(votes) AS INTEGER)
+    FROM episodes
+    GROUP BY 1, 2, 3, 4
+'''
+
+
+def aggregate_cells(rows):
+    cells = {}
+    for show, season, year, bucket, episodes, rated, rating_sum, min_rating, max_rating, votes in rows:
+        cell = cells.get((show, season, year))
+        if cell is None:
+            cell = cells[(show, season, year)] = {
+                'episodes': 0, 'rated': 0, 'rating_sum': 0.0, 'min_rating': None, 'max_rating': None,
+                'votes': 0, 'rating_histogram': [0] * RATING_BUCKETS,
+            }
+        cell['episodes'] += episodes
+        cell['rated'] += rated
+        cell['rating_sum'] += rating_sum
+        cell['votes'] += votes
+        if bucket is not None:
+            cell['rating_histogram'][min(max(bucket, 0), RATING_BUCKETS - 1)] += rated
+            cell['min_rating'] = min_rating if cell['min_rating'] is None else min(cell['min_rating'], min_rating)
+            cell['max_rating'] = max_rating if cell['max_rating'] is None else max(cell['max_rating'], max_rating)
+    return [
+        StatsCell(show, season, year, **{**cell, 'rating_histogram': tuple(cell['rating_histogram'])})
+        for (show, season, year), cell in cells.items()
+    ]
+
+
+def create_stats_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS episode_stats (
+            show TEXT,
+            season INTEGER,
+            year INTEGER,
+            episodes INTEGER,
+            rated INTEGER,
+            rating_sum REAL,
+            min_rating REAL,
+            max_rating REAL,
+            votes INTEGER,
+            rating_histogram TEXT,
+            PRIMARY KEY (show, season, year)
+        )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+
+# Recompute the summary table from the episodes, after a scrape
+#
+# the table remembers the data version it was computed at; this write doesn't bump it, so the
+# app's caches stay valid. Returns False when the table was already up to date.
+def refresh_episode_stats(db_file=None, force=False):
+    db_file = db_file or db.DB_FILE
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        data_version = get_data_version(conn)
+        stored = conn.execute("SELECT value FROM meta WHERE key = 'stats_data_version'").fetchone()
+        if not force and stored is not None and stored[0] == data_version:
+            return False
+
+        cells = aggregate_cells(conn.execute(AGGREGATE_QUERY).fetchall())
+        with conn:
+            # recreated rather than emptied, so a table from an older layout is replaced too
+            conn.execute("DROP TABLE IF EXISTS episode_stats")
+            create_stats_tables(conn)
+            conn.executemany(
+                "INSERT INTO episode_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*cell[:-1], json.dumps(cell.rating_histogram)) for cell in cells]
+            )
+            conn.execute('''
+                INSERT INTO meta (key, value) VALUES ('stats_data_version', ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', (data_version,))
+    finally:
+        conn.close()
+    print(f"Summarized the episodes into {len(cells)} statistics rows")
+    return True
+
+
+# "1999-01-01".."2003-12-31" -> (1999, 2003); None when the range doesn't cover whole years
+def whole_years(start_date, end_date):
+    if not (start_date and end_date):
+        return None
+    start_date, end_date = start_date[:10], end_date[:10]
+    if start_date[4:] != "-01-01" or end_date[4:] != "-12-31":
+        return None
+    return int(start_date[:4]), int(end_date[:4])
+
+
+# the first histogram bucket a "min rating" covers exactly; None between bucket boundaries
+def first_bucket(min_rating):
+    position = min_rating / RATING_BUCKET
+    if position != int(position):
+        return None
+    return max(int(position), 0)
+
+
+# count, rating and votes totals of some cells
+#
+# with a min rating, only the count is known (from the histograms); the other fields are None
+def summarize(cells, min_rating=None):
+    if min_rating is not None:
+        first = first_bucket(min_rating)
+        return {
+            'episodes': sum(sum(cell.rating_histogram[first:]) for cell in cells),
+            'mean_rating': None, 'min_rating': None, 'max_rating': None, 'votes': None,
+        }
+    rated = sum(cell.rated for cell in cells)
+    return {
+        'episodes': sum(cell.episodes for cell in cells),
+        'mean_rating': sum(cell.rating_sum for cell in cells) / rated if rated else None,
+        'min_rating': min((cell.min_rating for cell in cells if cell.min_rating is not None), default=None),
+        'max_rating': max((cell.max_rating for cell in cells if cell.max_rating is not None), default=None),
+        'votes': sum(cell.votes for cell in cells),
+    }
+
+
+# the summary cells held in memory, answering the UI's filters without touching the episodes table
+#
+# cells are indexed by show and season, so a show or season filter only looks at its own cells
+class StatsCube:
+    def __init__(self, cells, data_version, db_file):
+        self.data_version = data_version
+        self.db_file = db_file
+        self.by_show = {}
+        for cell in cells:
+            self.by_show.setdefault(cell.show, {}).setdefault(cell.season, []).append(cell)
+
+    def shows(self):
+        return sorted(self.by_show)
+
+    # the filters the cube can answer: a date range of whole years and a min rating on a bucket boundary
+    @staticmethod
+    def answerable(start_date=None, end_date=None, min_rating=None):
+        if start_date and end_date and whole_years(start_date, end_date) is None:
+            return False
+        return min_rating is None or first_bucket(min_rating) is not None
+
+    # the cells of one show matching the filters, the same ones build_filters turns into SQL
+    def _cells(self, show, start_date=None, end_date=None, season=None):
+        seasons = self.by_show.get(show, {})
+        cells = seasons.get(season, []) if season is not None else [
+            cell for season_cells in seasons.values() for cell in season_cells
+        ]
+        if start_date and end_date:
+            first_year, last_year = whole_years(start_date, end_date)
+            cells = [cell for cell in cells if cell.year is not None and first_year <= cell.year <= last_year]
+        return cells
+
+    # summary of the episodes matching the filters, or None when only the episodes table can answer them
+    def summary(self, show=None, start_date=None, end_date=None, min_rating=None, season=None):
+        if not self.answerable(start_date, end_date, min_rating):
+            return None
+        shows = [show] if show else self.by_show
+        cells = [cell for name in shows for cell in self._cells(name, start_date, end_date, season)]
+        return summarize(cells, min_rating)
+
+    # number of episodes matching the filters, or None when the cube can't answer them
+    def count(self, *filters):
+        summary = self.summary(*filters)
+        return None if summary is None else summary['episodes']
+
+    # {show: number of matching episodes} for every show, or None when the cube can't answer the filters
+    def counts_by_show(self, start_date=None, end_date=None, min_rating=None, season=None):
+        if not self.answerable(start_date, end_date, min_rating):
+            return None
+        return {
+            show: summarize(self._cells(show, start_date, end_date, season), min_rating)['episodes']
+            for show in self.by_show
+        }
+
+
+def load_cube(db_file=None):
+    db_file = db_file or db.DB_FILE
+    with db.connection(db_file) as conn:
+        data_version = get_data_version(conn)
+        cells = None
+        try:
+            stored = conn.execute("SELECT value FROM meta WHERE key = 'stats_data_version'").fetchone()
+            if stored is not None and stored[0] == data_version:
+                rows = conn.execute(f"SELECT {', '.join(StatsCell._fields)} FROM episode_stats").fetchall()
+                cells = [StatsCell(*row[:-1], tuple(json.loads(row[-1]))) for row in rows]
+        except sqlite3.OperationalError:
+            # no summary table yet, or one from an older layout: refresh_episode_stats replaces it
+            pass
+        if cells is None:
+            # the table is behind the data (e.g. a write outside the scraper), so aggregate once here
+            cells = aggregate_cells(conn.execute(AGGREGATE_QUERY).fetchall())
+    return StatsCube(cells, data_version, db_file)
+
+
+_cube = None
+_cube_lock = threading.Lock()
+
+
+# the cube for the current data version, reloaded once after each scrape
+def get_episode_stats(db_file=None):
+    global _cube
+    db_file = db_file or db.DB_FILE
+    with db.connection(db_file) as conn:
+        key = (db_file, get_data_version(conn))
+    cube = _cube
+    if cube is None or (cube.db_file, cube.data_version) != key:
+        with _cube_lock:
+            if _cube is None or (_cube.db_file, _cube.data_version) != key:
+                _cube = load_cube(db_file)
+            cube = _cube
+    return cube
+
+
+if __name__ == "__main__":
+    refresh_episode_stats(force=True)
@@ -0,0 +1,97 @@
+import os
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from urllib3.util.retry import Retry
+
+from driver_pool import USER_AGENT
+
+# errors worth retrying: page timeouts, crashed browsers, network/HTTP failures
+RETRYABLE_ERRORS = (WebDriverException, requests.RequestException)
+
+# Every fetcher has the same interface: fetch(url) -> page html
+
+
+# plain HTTP through a pooled requests session; IMDb embeds the episode list in the page,
+# so no browser is needed to render it
+class HttpFetcher:
+    def __init__(self, rate_limiter=None, pool_size=10, timeout=20):
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Language": "en-US,en;q=0.9",  # IMDb localizes titles and dates otherwise
+        })
+        # connection errors and 5xx are retried by urllib3; the scraper retries the rest
+        retry = Retry(total=2, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def fetch(self, url):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        print(f"Fetching season URL: {url}")
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+# headless Chrome from a DriverPool, for pages that only render with JavaScript
+class SeleniumFetcher:
+    def __init__(self, pool, rate_limiter=None, timeout=10):
+        self.pool = pool
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+
+    def fetch(self, url):
+        with self.pool.driver() as driver:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            print(f"Opening season URL: {url}")
+            driver.get(url)
+
+            # Wait for episodes to load
+            wait = WebDriverWait(driver, self.timeout)
+            wait.until(EC.presence_of_element_located((By.CLASS_NAME, "episode-item-wrapper")))
+
+            return driver.page_source
+
+    def close(self):
+        self.pool.close()
+
+
+# file name a season page is saved under, e.g. tt0182576_season_1.html
+def fixture_name(url):
+    title_id = re.search(r"(tt\d+)", url)
+    season = re.search(r"season=(\d+)", url)
+    return f"{title_id.group(1) if title_id else 'page'}_season_{season.group(1) if season else 0}.html"
+
+
+def save_fixture(directory, url, page_source):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, fixture_name(url)), "w", encoding="utf-8") as f:
+        f.write(page_source)
+
+
+# saved season pages from a directory, for parsing and benchmarking without network or browser
+class FixtureFetcher:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, url):
+        path = os.path.join(self.directory, fixture_name(url))
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def close(self):
+        pass
@@ -0,0 +1,132 @@
+# Rebuilds the season page fixtures in fixtures/seasons from episodes.db.
+#
+# The pages reproduce the two things the scraper reads from an IMDb season page: the rendered
+# episode cards (episode-item-wrapper articles) and the __NEXT_DATA__ JSON. Real pages can be
+# captured instead with `python imdb_scrape.py --save-html fixtures/seasons`.
+#
+#   python fixtures/build_fixtures.py
+import html
+import json
+import os
+import sqlite3
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from episode_fields import format_air_date, legacy_votes, parse_air_date  # noqa: E402
+
+TITLE_IDS = {
+    "Family Guy": "tt0182576",
+    "South Park": "tt0121955",
+    "The Simpsons": "tt0096697",
+}
+
+# a few seasons of different sizes
+SEASONS = [("Family Guy", 1), ("South Park", 5), ("The Simpsons", 10)]
+
+
+# the vote count as IMDb prints it, e.g. (4.7K)
+def vote_label(votes):
+    if votes is None:
+        return None
+    if votes >= 1000:
+        return "(" + f"{votes / 1000:.1f}".rstrip("0").rstrip(".") + "K)"
+    return f"({votes})"
+
+
+def release_date(air_date):
+    if not air_date:
+        return None
+    year, month, day = map(int, air_date.split("-"))
+    return {"year": year, "month": month, "day": day}
+
+
+# rows with ISO dates and exact vote counts, whether or not the database has been migrated yet
+def normalized_rows(conn, rows):
+    migrated = conn.execute("PRAGMA user_version").fetchone()[0] >= 1
+    normalized = []
+    for row in rows:
+        row = dict(row)
+        row["air_date"] = parse_air_date(row["air_date"])
+        row["votes"] = row["votes"] if migrated or row["votes"] is None else legacy_votes(row["votes"])
+        normalized.append(row)
+    return normalized
+
+
+def episode_card(row):
+    rating = ""
+    if row["rating"] is not None:
+        rating = (
+            f'<span class="ipc-rating-star--rating">{row["rating"]}</span>'
+            f'<span class="ipc-rating-star--voteCount">{vote_label(row["votes"])}</span>'
+        )
+    return f'''
+<article class="sc-f8507e90-1 cHtpvn episode-item-wrapper">
+  <img class="ipc-image" src="{html.escape(row["image"] or "")}"/>
+  <a href="/title/{TITLE_IDS[row["show"]]}/"><div class="ipc-title__text">{html.escape(row["episode_title"])}</div></a>
+  <span class="sc-f2169d65-10 bYaARM">{html.escape(format_air_date(row["air_date"]))}</span>
+  <div class="ipc-html-content-inner-div">{html.escape(row["plot"] or "")}</div>
+  <div class="sc-e2dbc1a3-0">{rating}</div>
+</article>'''
+
+
+def next_data(rows, num_seasons):
+    items = [
+        {
+            "id": f"tt{row['id']:07d}",
+            "type": "tvEpisode",
+            "season": str(row["season"]),
+            "episode": str(row["episode"]),
+            "titleText": row["episode_title"].split("∙", 1)[-1].strip(),
+            "releaseDate": release_date(row["air_date"]),
+            "image": {"url": row["image"]} if row["image"] else None,
+            "plot": row["plot"],
+            "aggregateRating": row["rating"],
+            "voteCount": row["votes"],
+        }
+        for row in rows
+    ]
+    section = {
+        "seasons": [{"value": str(season)} for season in range(1, num_seasons + 1)],
+        "episodes": {"items": items, "total": len(items)},
+    }
+    return {"props": {"pageProps": {"contentData": {"section": section}}}}
+
+
+def build(db_file=os.path.join(HERE, "..", "episodes.db"), out_dir=os.path.join(HERE, "seasons")):
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    os.makedirs(out_dir, exist_ok=True)
+
+    for show, season in SEASONS:
+        rows = conn.execute('''
+            SELECT * FROM episodes WHERE show = ? AND season = ?
+            GROUP BY episode ORDER BY episode
+        ''', (show, season)).fetchall()
+        rows = normalized_rows(conn, rows)
+        num_seasons = conn.execute("SELECT MAX(season) FROM episodes WHERE show = ?", (show,)).fetchone()[0]
+
+        # "</" inside the JSON would end the script tag early
+        data = json.dumps(next_data(rows, num_seasons)).replace("</", "<\\/")
+        page = f'''<!DOCTYPE html>
+<html lang="en-US">
+<head><title>{html.escape(show)} (TV Series) - Season {season} - IMDb</title></head>
+<body>
+<section class="sc-1e7f96be-0">
+{"".join(episode_card(row) for row in rows)}
+</section>
+<script id="__NEXT_DATA__" type="application/json">{data}</script>
+</body>
+</html>
+'''
+        path = os.path.join(out_dir, f"{TITLE_IDS[show]}_season_{season}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(page)
+        print(f"Wrote {path} ({len(rows)} episodes)")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,84 @@
+import re
+import sqlite3
+
+from db import connection
+
+# title matches count twice as much as plot matches in the bm25 ranking
+TITLE_WEIGHT = 2.0
+PLOT_WEIGHT = 1.0
+
+
+# create the FTS5 table over episode_title and plot, plus the triggers that keep it in sync
+def ensure_fts_index(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'episodes_fts'"
+    ).fetchone()
+
+    conn.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5(
+            episode_title,
+            plot,
+            content='episodes',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS episodes_fts_insert AFTER INSERT ON episodes BEGIN
+            INSERT INTO episodes_fts (rowid, episode_title, plot)
+            VALUES (new.id, new.episode_title, new.plot);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS episodes_fts_delete AFTER DELETE ON episodes BEGIN
+            INSERT INTO episodes_fts (episodes_fts, rowid, episode_title, plot)
+            VALUES ('delete', old.id, old.episode_title, old.plot);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS episodes_fts_update AFTER UPDATE OF episode_title, plot ON episodes BEGIN
+            INSERT INTO episodes_fts (episodes_fts, rowid, episode_title, plot)
+            VALUES ('delete', old.id, old.episode_title, old.plot);
+            INSERT INTO episodes_fts (rowid, episode_title, plot)
+            VALUES (new.id, new.episode_title, new.plot);
+        END;
+    ''')
+
+    # first time: index the rows that were already there
+    if not exists:
+        conn.execute("INSERT INTO episodes_fts (episodes_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+# turn free text from the search box into an FTS5 query: any of the words, each quoted
+def fts_query(text):
+    words = re.findall(r"\w+", text or '')
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+def _where(where_clause):
+    return f" AND ({where_clause})" if where_clause else ""
+
+
+# rank with bm25 inside SQLite and apply the UI filters in the same query; returns (page ids, total)
+def search_episodes(search_title, where_clause=None, params=(), limit=10, offset=0, db_file=None):
+    match = fts_query(search_title)
+    if not match:
+        return [], 0
+
+    from_clause = f'''
+        FROM episodes_fts
+        JOIN episodes ON episodes.id = episodes_fts.rowid
+        WHERE episodes_fts MATCH ?{_where(where_clause)}
+    '''
+    with connection(db_file) as conn:
+        total = conn.execute(f"SELECT COUNT(*) {from_clause}", [match, *params]).fetchone()[0]
+        ids = [row[0] for row in conn.execute(f'''
+            SELECT episodes.id {from_clause}
+            ORDER BY bm25(episodes_fts, {TITLE_WEIGHT}, {PLOT_WEIGHT})
+            LIMIT ? OFFSET ?
+        ''', [match, *params, limit, offset])]
+    return ids, total
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect("episodes.db")
+    ensure_fts_index(conn)
+    conn.close()
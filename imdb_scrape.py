@@ -1,113 +1,461 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+import argparse
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from multiprocessing import get_context
 import sqlite3
 import time
+from db import DB_FILE
+from rate_limit import TokenBucket
+from schema import bump_data_version, create_schema
+from season_parser import parse_season_numbers, parse_season_page, parse_show_name
 
-# Function to scrape all episodes for a given season URL
-def scrape_episodes_from_season(season_url, db_file, show_name):
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument(f"user-agent={user_agent}")
-    driver = webdriver.Chrome(options=options)
+# the parse workers are spawned and re-import this module, so the network clients (requests,
+# selenium) and the index building run after a scrape (serve.prepare) are imported where they are
+# used rather than here; a worker then only loads season_parser and the standard library
 
-    print(f"Opening season URL: {season_url}")
-    driver.get(season_url)
+# first retry waits RETRY_BACKOFF seconds, then twice as long each time
+RETRY_BACKOFF = 5
 
-    # Wait for episodes to load
-    wait = WebDriverWait(driver, 10)
-    wait.until(EC.presence_of_element_located((By.CLASS_NAME, "episode-item-wrapper")))
+# fetched pages allowed to wait per parse worker before fetchers block
+PAGES_PER_PARSE_WORKER = 2
+# most seasons written in one transaction
+WRITE_BATCH = 8
+# how long the pipeline waits for a page or a parse result before checking the other
+PAGE_POLL_SECONDS = 0.1
 
-    # Parse the page source with BeautifulSoup
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    driver.quit()
 
-    # Connect to SQLite database
+UPSERT_EPISODE = '''
+    INSERT INTO episodes (show, season, episode, episode_title, air_date, rating, votes, plot, image)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (show, season, episode) DO UPDATE SET
+        episode_title = excluded.episode_title,
+        air_date = excluded.air_date,
+        rating = excluded.rating,
+        votes = excluded.votes,
+        plot = excluded.plot,
+        image = COALESCE(excluded.image, episodes.image)
+    WHERE episode_title IS NOT excluded.episode_title
+        OR air_date IS NOT excluded.air_date
+        OR rating IS NOT excluded.rating
+        OR votes IS NOT excluded.votes
+        OR plot IS NOT excluded.plot
+        OR (excluded.image IS NOT NULL AND image IS NOT excluded.image)
+'''
+
+
+UPDATE_CRAWL_STATE = '''
+    INSERT INTO crawl_state (url, show, season, fetched_at, content_hash, episode_count, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (url) DO UPDATE SET
+        fetched_at = excluded.fetched_at,
+        content_hash = excluded.content_hash,
+        episode_count = excluded.episode_count,
+        status = excluded.status
+'''
+
+
+# a stable fingerprint of a parsed season, to tell whether anything changed since the last crawl
+def episodes_hash(episodes):
+    return hashlib.sha256(json.dumps(episodes, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_crawl_state(db_file):
     conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    # Create table if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS episodes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            show TEXT,
-            season INTEGER,
-            episode INTEGER,
-            episode_title TEXT,
-            air_date TEXT,
-            rating REAL,
-            votes INTEGER,
-            plot TEXT
-        )
-    ''')
+    conn.row_factory = sqlite3.Row
+    state = {row['url']: dict(row) for row in conn.execute("SELECT * FROM crawl_state")}
+    conn.close()
+    return state
 
-    # Extract episodes
-    episodes = soup.find_all('article', class_='sc-f8507e90-1 cHtpvn episode-item-wrapper')
+
+# Write one season's episodes and its crawl state on an open connection; the caller commits
+#
+# rows are upserted on (show, season, episode), so re-running the scraper updates episodes in place
+# instead of duplicating them; unchanged rows are not rewritten, and an unchanged season not at all.
+# Returns False when the season was unchanged since the last crawl.
+def save_season(conn, show_name, episodes, season_url=None, season=None):
+    content_hash = episodes_hash(episodes)
+    # a page without episodes is most likely a failed load, so it is tried again next run
+    status = "done" if episodes else "empty"
+
+    previous = None
+    if season_url:
+        previous = conn.execute("SELECT content_hash FROM crawl_state WHERE url = ?", (season_url,)).fetchone()
+    unchanged = previous is not None and previous[0] == content_hash
+
+    if not unchanged:
+        changes = conn.total_changes
+        conn.executemany(UPSERT_EPISODE, [
+            (show_name, episode['season'], episode['episode'], episode['episode_title'], episode['air_date'],
+             episode['rating'], episode['votes'], episode['plot'], episode['image'])
+            for episode in episodes
+        ])
+        # tell the app's caches that episodes changed
+        if conn.total_changes > changes:
+            bump_data_version(conn)
+    if season_url:
+        conn.execute(UPDATE_CRAWL_STATE, (
+            season_url, show_name, season, datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            content_hash, len(episodes), status
+        ))
+    return not unchanged
+
+
+def report_season(show_name, episodes, season, changed):
+    if not changed:
+        print(f"Unchanged: {show_name} season {season} ({len(episodes)} episodes)")
+        return
     for episode in episodes:
-        # Extract episode metadata
-        episode_title_tag = episode.find('div', class_='ipc-title__text')
-        episode_title = episode_title_tag.text.strip() if episode_title_tag else "N/A"
+        print(f"Scraped: Season {episode['season']}, Episode {episode['episode']}: {episode['episode_title']}")
 
-        air_date_tag = episode.find('span', class_='sc-f2169d65-10 bYaARM')
-        air_date = air_date_tag.text.strip() if air_date_tag else "N/A"
 
-        rating_tag = episode.find('span', class_='ipc-rating-star--rating')
-        rating = float(rating_tag.text.strip()) if rating_tag else None
+# Write one season's episodes and its crawl state to the database in a single transaction
+def save_episodes(db_file, show_name, episodes, season_url=None, season=None):
+    # other workers may be writing, so wait for the lock
+    conn = sqlite3.connect(db_file, timeout=30)
+    with conn:
+        changed = save_season(conn, show_name, episodes, season_url, season)
+    conn.close()
+    report_season(show_name, episodes, season, changed)
 
-        votes_tag = episode.find('span', class_='ipc-rating-star--voteCount')
-        votes = float(votes_tag.text.replace('(', '').replace(')', '').replace('K', '000').strip()) if votes_tag else None
 
-        plot_tag = episode.find('div', class_='ipc-html-content-inner-div')
-        plot = plot_tag.text.strip() if plot_tag else "N/A"
+# Fetch one season page, trying the fetchers from `start` on; returns the page and the fetcher used
+def fetch_season_page(season_url, fetchers, start=0, save_html=None):
+    from fetchers import RETRYABLE_ERRORS, save_fixture
 
-        # Parse season and episode numbers
-        episode_info = episode_title.split('∙')[0].strip() if '∙' in episode_title else "S0.E0"
-        season, episode_number = map(int, episode_info.replace('S', '').replace('E', '').split('.'))
+    for i in range(start, len(fetchers)):
+        try:
+            page_source = fetchers[i].fetch(season_url)
+        except RETRYABLE_ERRORS:
+            if i == len(fetchers) - 1:
+                raise
+            continue
+        if save_html:
+            save_fixture(save_html, season_url, page_source)
+        return page_source, i
 
-        # Insert into SQLite database
-        cursor.execute('''
-            INSERT INTO episodes (show, season, episode, episode_title, air_date, rating, votes, plot)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (show_name, season, episode_number, episode_title, air_date, rating, votes, plot))
 
-        print(f"Scraped: Season {season}, Episode {episode_number}: {episode_title}")
+# Fetch one season page, retrying with exponential backoff when the page does not load
+def fetch_season_with_retries(season_url, fetchers, retries, start=0, save_html=None):
+    from fetchers import RETRYABLE_ERRORS
 
-    # Commit changes and close the connection
-    conn.commit()
-    conn.close()
-    print(f"Finished scraping season from {season_url}")
+    for attempt in range(retries + 1):
+        try:
+            return fetch_season_page(season_url, fetchers, start, save_html)
+        except RETRYABLE_ERRORS as e:
+            # TimeoutException from WebDriverWait is a WebDriverException; so is a crashed browser
+            if attempt == retries:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+            print(f"Retrying {season_url} in {delay}s after {type(e).__name__} (attempt {attempt + 1} of {retries})")
+            time.sleep(delay)
 
-# Function to scrape all seasons for a given show
-def scrape_all_seasons(base_url, num_seasons, db_file, show_name):
-    for season in range(1, num_seasons + 1):
-        season_url = f"{base_url}?season={season}"
-        scrape_episodes_from_season(season_url, db_file, show_name)
-        time.sleep(2)  # Avoid hitting IMDb's rate limit
 
-# Main function
-def main():
-    # base_url = "https://www.imdb.com/title/tt0182576/episodes/"  # Family Guy
-    # base_url = "https://www.imdb.com/title/tt0121955/episodes/"  # South Park
-    # base_url = "https://www.imdb.com/title/tt0096697/episodes/"  # The Simpsons
-    shows = {
-        "Family Guy": {"link":"https://www.imdb.com/title/tt0182576/episodes/", "seasons": 23},
-        "South Park": {"link":"https://www.imdb.com/title/tt0121955/episodes/", "seasons": 30},
-        "The Simpsons": {"link":"https://www.imdb.com/title/tt0096697/episodes/", "seasons": 36}
+# a show's episode list; ?season=N selects a season
+SHOW_URL = "https://www.imdb.com/title/{title_id}/episodes/"
+
+
+# The configured shows, in the shape plan_seasons takes: {name: {"title_id", "link", "seasons"}}
+def load_shows(db_file):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT title_id, name, seasons FROM shows ORDER BY name").fetchall()
+    conn.close()
+    return {
+        name: {"title_id": title_id, "link": SHOW_URL.format(title_id=title_id), "seasons": seasons or 0}
+        for title_id, name, seasons in rows
     }
-    db_file = "episodes.db"
 
+
+# Fetch a show's first season page once; it lists every season of the show and carries its name
+def fetch_show_page(title_id, fetchers, retries=0):
+    page_source, _ = fetch_season_with_retries(f"{SHOW_URL.format(title_id=title_id)}?season=1", fetchers, retries)
+    return page_source
+
+
+def save_show(db_file, title_id, name, seasons):
+    conn = sqlite3.connect(db_file, timeout=30)
+    with conn:
+        conn.execute('''
+            INSERT INTO shows (title_id, name, seasons, seasons_checked_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (title_id) DO UPDATE SET
+                name = excluded.name,
+                seasons = COALESCE(excluded.seasons, shows.seasons),
+                seasons_checked_at = COALESCE(excluded.seasons_checked_at, shows.seasons_checked_at)
+        ''', (title_id, name, seasons, datetime.now(timezone.utc).isoformat(timespec='seconds') if seasons else None))
+    conn.close()
+
+
+# Update every show's season count from its episodes page, one request per show
+#
+# a show whose page can't be fetched or read keeps the count it had, so a bad request never
+# shrinks the crawl
+def discover_seasons(db_file, shows, fetchers, retries=0):
+    for name, show in shows.items():
+        try:
+            seasons = parse_season_numbers(fetch_show_page(show["title_id"], fetchers, retries))
+        except Exception as e:
+            print(f"Could not discover the seasons of {name}, keeping {show['seasons']}: {e!r}")
+            continue
+        if not seasons:
+            print(f"No seasons listed for {name}, keeping {show['seasons']}")
+            continue
+        if max(seasons) != show["seasons"]:
+            print(f"{name}: {show['seasons']} -> {max(seasons)} seasons")
+        show["seasons"] = max(seasons)
+        save_show(db_file, show["title_id"], name, show["seasons"])
+    return shows
+
+
+# Add a show to the catalogue by IMDb title id, reading its name and seasons from its episodes page
+def add_show(db_file, title_id, fetchers, name=None, retries=0):
+    if not re.fullmatch(r"tt\d+", title_id):
+        raise ValueError(f"not an IMDb title id: {title_id!r}")
+    page_source = fetch_show_page(title_id, fetchers, retries)
+    name = name or parse_show_name(page_source)
+    if not name:
+        raise ValueError(f"could not read the name of {title_id}, pass it with --name")
+    seasons = parse_season_numbers(page_source)
+    try:
+        save_show(db_file, title_id, name, max(seasons) if seasons else None)
+    except sqlite3.IntegrityError:
+        raise ValueError(f"another show is already called {name!r}, pass a different --name")
+    print(f"Added {name} ({title_id}) with {max(seasons) if seasons else 'unknown'} seasons")
+
+
+# The seasons that need fetching: everything never finished, plus the newest seasons of each show
+#
+# older seasons that were crawled completely don't change any more, so they are skipped; a crashed
+# run resumes with whatever it had not finished, since those seasons were never marked done
+def plan_seasons(shows, crawl_state, recheck_latest=1, full=False):
+    jobs = []
+    skipped = 0
     for show_name, show_data in shows.items():
-        link = show_data["link"]
         num_seasons = show_data["seasons"]
-        print(f"Starting to scrape all seasons for {show_name}...")
-        scrape_all_seasons(link, num_seasons, db_file, show_name)
+        for season in range(1, num_seasons + 1):
+            season_url = f"{show_data['link']}?season={season}"
+            state = crawl_state.get(season_url)
+            is_latest = season > num_seasons - recheck_latest
+            if not full and not is_latest and state and state['status'] == "done":
+                skipped += 1
+                continue
+            jobs.append((show_name, season, season_url))
+    print(f"{len(jobs)} season(s) to fetch, {skipped} complete season(s) skipped")
+    return jobs
+
+
+# Scrape the planned seasons as a pipeline: fetch threads -> bounded page queue -> parse processes
+# -> a single writer thread
+#
+# fetching waits on the network and parsing on the CPU, so each gets its own pool and they overlap;
+# the page queue is bounded, so fetchers block instead of piling up pages when the parsers fall
+# behind. One writer owns the database connection and commits a batch of seasons per transaction.
+# A page that parses to no episodes is fetched again with the next fetcher (e.g. the browser).
+class ScrapePipeline:
+    def __init__(self, db_file, fetchers, concurrency=1, parse_workers=None, retries=3, save_html=None):
+        self.db_file = db_file
+        self.fetchers = fetchers
+        self.concurrency = concurrency
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        self.retries = retries
+        self.save_html = save_html
+        self.pages = queue.Queue(maxsize=PAGES_PER_PARSE_WORKER * max(1, self.parse_workers))
+        self.writes = queue.Queue(maxsize=WRITE_BATCH * 2)
+        self.failed = []
+        self._failed_lock = threading.Lock()
+
+    def _fail(self, season_url, error):
+        print(f"Failed to scrape {season_url}: {error!r}")
+        with self._failed_lock:
+            self.failed.append(season_url)
+
+    # fetch thread: put the page on the queue (an exception in place of the page if it failed)
+    def _fetch(self, job, start):
+        show_name, season, season_url = job
+        try:
+            page_source, fetcher_index = fetch_season_with_retries(
+                season_url, self.fetchers, self.retries, start, self.save_html
+            )
+        except Exception as e:
+            self.pages.put((job, None, e))
+            return
+        self.pages.put((job, fetcher_index, page_source))
+
+    # writer thread: write whatever seasons are waiting (up to WRITE_BATCH) in one transaction
+    def _write(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        done = False
+        while not done:
+            batch = [self.writes.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+
+            try:
+                with conn:
+                    changed = [save_season(conn, show_name, episodes, season_url, season)
+                               for (show_name, season, season_url), episodes in batch]
+            except sqlite3.Error as e:
+                for (_, _, season_url), _ in batch:
+                    self._fail(season_url, e)
+                continue
+            for ((show_name, season, season_url), episodes), season_changed in zip(batch, changed):
+                report_season(show_name, episodes, season, season_changed)
+                print(f"Finished scraping season from {season_url}")
+        conn.close()
+
+    def run(self, jobs):
+        writer = threading.Thread(target=self._write, name="scrape-writer")
+        writer.start()
+        if self.parse_workers:
+            # spawned rather than forked: the fetch and writer threads are already running; see the
+            # imports at the top of this file for what a worker loads
+            parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=get_context("spawn"))
+        else:
+            # parse on a thread instead, e.g. where worker processes are not available
+            parse_pool = ThreadPoolExecutor(max_workers=1)
+
+        remaining = len(jobs)
+        parsing = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as fetch_pool:
+                for job in jobs:
+                    fetch_pool.submit(self._fetch, job, 0)
+
+                while remaining:
+                    # hand fetched pages to the parsers, as many as there are workers to keep busy
+                    while len(parsing) < max(1, self.parse_workers):
+                        try:
+                            job, fetcher_index, page = self.pages.get(timeout=0 if parsing else PAGE_POLL_SECONDS)
+                        except queue.Empty:
+                            break
+                        if fetcher_index is None:
+                            self._fail(job[2], page)
+                            remaining -= 1
+                            continue
+                        parsing[parse_pool.submit(parse_season_page, page)] = (job, fetcher_index)
+
+                    if not parsing:
+                        continue
+                    finished, _ = wait(parsing, timeout=PAGE_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        job, fetcher_index = parsing.pop(future)
+                        try:
+                            episodes = future.result()
+                        except Exception as e:
+                            self._fail(job[2], e)
+                            remaining -= 1
+                            continue
+                        if not episodes and fetcher_index < len(self.fetchers) - 1:
+                            fetch_pool.submit(self._fetch, job, fetcher_index + 1)
+                            continue
+                        self.writes.put((job, episodes))
+                        remaining -= 1
+        finally:
+            parse_pool.shutdown()
+            self.writes.put(None)
+            writer.join()
+        return self.failed
+
+
+# Function to scrape the planned seasons
+def scrape_all_seasons(jobs, db_file, fetchers, concurrency=1, retries=3, save_html=None, parse_workers=None):
+    failed = ScrapePipeline(db_file, fetchers, concurrency, parse_workers, retries, save_html).run(jobs)
+    print(f"Scraped {len(jobs) - len(failed)} of {len(jobs)} seasons")
+    return failed
+
+
+# The fetchers for a backend, in the order they are tried
+def create_fetchers(backend, rate_limiter, concurrency, pages_per_browser, fixtures=None):
+    from driver_pool import DriverPool
+    from fetchers import FixtureFetcher, HttpFetcher, SeleniumFetcher
+
+    if backend == "fixtures":
+        return [FixtureFetcher(fixtures)]
+
+    # browsers are only started if a page actually needs one
+    selenium_fetcher = SeleniumFetcher(DriverPool(size=concurrency, max_pages=pages_per_browser), rate_limiter)
+    if backend == "selenium":
+        return [selenium_fetcher]
+    return [HttpFetcher(rate_limiter, pool_size=concurrency), selenium_fetcher]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape IMDb episode pages into episodes.db")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite database to write to (default: $EPISODES_DB or episodes.db)")
+    parser.add_argument("--backend", choices=["http", "selenium", "fixtures"], default="http",
+                        help="http: plain requests, falling back to the browser; selenium: browser only; "
+                             "fixtures: saved pages from --fixtures, no network")
+    parser.add_argument("--fixtures", default="fixtures/seasons", help="directory of saved season pages")
+    parser.add_argument("--save-html", metavar="DIR", help="save every fetched season page into DIR")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of seasons scraped at the same time (one browser each)")
+    parser.add_argument("--rate", type=float, default=0.5, help="maximum page loads per second, across all workers")
+    parser.add_argument("--retries", type=int, default=3, help="retries per season after a timeout")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="processes parsing fetched pages (default: one per CPU; 0 parses on a thread)")
+    parser.add_argument("--recheck-latest", type=int, default=1,
+                        help="always re-fetch this many of the newest seasons of each show")
+    parser.add_argument("--full", action="store_true", help="re-fetch every season, ignoring the crawl state")
+    parser.add_argument("--add-show", metavar="TITLE_ID", help="add a show by IMDb title id (e.g. tt0182576) and exit")
+    parser.add_argument("--name", help="name for --add-show (default: read from the show's page)")
+    parser.add_argument("--list-shows", action="store_true", help="print the configured shows and exit")
+    parser.add_argument("--no-discover", action="store_true",
+                        help="use the stored season counts instead of checking each show's page first")
+    parser.add_argument("--pages-per-browser", type=int, default=50,
+                        help="restart a browser after this many pages")
+    return parser.parse_args()
+
+
+# Main function
+def main():
+    args = parse_args()
+
+    db_file = args.db
+
+    create_schema(db_file)
+    if args.list_shows:
+        for name, show in load_shows(db_file).items():
+            print(f"{show['title_id']}  {name}  ({show['seasons']} seasons)")
+        return
+
+    rate_limiter = TokenBucket(rate=args.rate)
+    fetchers = create_fetchers(args.backend, rate_limiter, args.concurrency, args.pages_per_browser, args.fixtures)
+
+    try:
+        if args.add_show:
+            try:
+                add_show(db_file, args.add_show, fetchers, args.name, args.retries)
+            except ValueError as e:
+                raise SystemExit(f"Could not add {args.add_show}: {e}")
+            return
+
+        shows = load_shows(db_file)
+        if not args.no_discover:
+            discover_seasons(db_file, shows, fetchers, args.retries)
+        print(f"Starting to scrape all seasons for {', '.join(shows)} with {args.concurrency} worker(s)...")
+        jobs = plan_seasons(shows, load_crawl_state(db_file), args.recheck_latest, args.full)
+        scrape_all_seasons(
+            jobs, db_file, fetchers, args.concurrency, args.retries, args.save_html, args.parse_workers
+        )
         print(f"All seasons have been scraped and saved to {db_file}")
-        
+    finally:
+        for fetcher in fetchers:
+            fetcher.close()
+
+    # similar episodes, statistics, search index and snapshot; a running server switches to the new versions
+    from serve import prepare
+    prepare(db_file, list(shows))
+
 
 if __name__ == "__main__":
     main()
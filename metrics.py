@@ -0,0 +1,198 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timezone
+
+# upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# observations kept per series for the recent percentiles
+WINDOW = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+# requests slower than this many seconds are logged with a cProfile dump; 0 turns the log off
+SLOW_REQUEST_SECONDS = float(os.environ.get("EPISODES_SLOW_REQUEST_SECONDS", "0"))
+SLOW_LOG_DIR = os.environ.get("EPISODES_SLOW_LOG_DIR", "slow_requests")
+
+
+# a Prometheus-style histogram (cumulative buckets, sum and count since start) that also keeps
+# the last WINDOW observations, so percentiles reflect recent traffic rather than all of it
+class Histogram:
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+            self.recent.append(value)
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count, recent = list(self.counts), self.sum, self.count, sorted(self.recent)
+        quantiles = {}
+        if recent:
+            for q in QUANTILES:
+                quantiles[q] = recent[min(len(recent) - 1, int(q * len(recent)))]
+        return counts, total, count, quantiles
+
+
+# histograms by (metric name, labels), plus gauges read when /metrics is scraped
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.help = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+                self.help.setdefault(name, help_text)
+        return histogram
+
+    def gauge(self, name, help_text, read):
+        self.gauges[name] = (help_text, read)
+
+    # everything in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                counts, total, count, _ = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip((*histogram.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+
+            # percentiles of the recent window, as a separate gauge so the histogram stays standard
+            lines.append(f"# HELP {name}_recent {self.help[name]} (last {WINDOW} observations)")
+            lines.append(f"# TYPE {name}_recent gauge")
+            for labels, histogram in series:
+                for q, value in histogram.snapshot()[3].items():
+                    lines.append(f"{name}_recent{_labels(labels, quantile=q)} {value}")
+
+        for name, (help_text, read) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+registry = Registry()
+
+# the callback running on this thread and the time spent in each of its stages so far
+_current = threading.local()
+
+
+# time a block of a callback as one stage, e.g. `with stage("query"):`
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        callback = getattr(_current, "callback", None) or "none"
+        registry.histogram(
+            "episodes_stage_seconds", "Time spent in one stage of a Dash callback",
+            callback=callback, stage=name
+        ).observe(elapsed)
+        stages = getattr(_current, "stages", None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def _profile_start():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active profiler, and another request is already using it
+        return None
+    return profiler
+
+
+def _log_slow_request(callback, elapsed, stages, args, kwargs, profiler):
+    os.makedirs(SLOW_LOG_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%f")
+    profile_file = None
+    if profiler is not None:
+        profile_file = os.path.join(SLOW_LOG_DIR, f"{stamp}_{callback}.prof")
+        profiler.dump_stats(profile_file)
+    entry = {
+        "time": stamp,
+        "callback": callback,
+        "seconds": round(elapsed, 4),
+        "stages": {name: round(seconds, 4) for name, seconds in stages.items()},
+        "inputs": [*args, *kwargs.items()],
+        "profile": profile_file,
+    }
+    with open(os.path.join(SLOW_LOG_DIR, "slow_requests.log"), "a") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+
+
+# time a whole callback; goes under @app.callback so Dash registers the timed function
+def timed(callback):
+    def decorator(fn):
+        histogram = registry.histogram(
+            "episodes_callback_seconds", "Time spent in a Dash callback", callback=callback
+        )
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _current.callback = callback
+            _current.stages = {}
+            profiler = _profile_start() if SLOW_REQUEST_SECONDS else None
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if profiler is not None:
+                    profiler.disable()
+                histogram.observe(elapsed)
+                if SLOW_REQUEST_SECONDS and elapsed > SLOW_REQUEST_SECONDS:
+                    _log_slow_request(callback, elapsed, _current.stages, args, kwargs, profiler)
+                _current.callback = None
+                _current.stages = None
+        return wrapper
+    return decorator
+
+
+# serve the metrics at /metrics on the app's Flask server
+def register_metrics_route(server):
+    from flask import Response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,30 @@
+import threading
+import time
+
+
+# a token bucket shared by every scraping worker
+#
+# tokens refill at `rate` per second up to `burst`; acquire() blocks until one is available,
+# so the whole scraper stays under `rate` page loads per second however many workers run
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,150 @@
+import sqlite3
+
+from episode_fields import legacy_votes, parse_air_date
+from fts_index import ensure_fts_index
+
+# bumped whenever a migration is added below; stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+# the shows the scraper started out with, seeded into the shows table once
+INITIAL_SHOWS = [
+    ("tt0182576", "Family Guy", 23),
+    ("tt0121955", "South Park", 30),
+    ("tt0096697", "The Simpsons", 36),
+]
+
+
+# a counter bumped by every write to the episode data; caches key on it to know when they are stale
+def bump_data_version(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+    conn.execute('''
+        INSERT INTO meta (key, value) VALUES ('data_version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    ''')
+
+
+def get_data_version(conn):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    except sqlite3.OperationalError:
+        # no meta table yet: nothing has been written since the schema was created
+        return 0
+    return row[0] if row else 0
+
+
+# version 1: ISO-8601 air dates, exact integer vote counts, indexes for the UI filters
+def normalize_episode_fields(conn):
+    rows = conn.execute("SELECT id, air_date, votes FROM episodes").fetchall()
+    conn.executemany(
+        "UPDATE episodes SET air_date = ?, votes = ? WHERE id = ?",
+        [(parse_air_date(air_date), legacy_votes(votes), episode_id) for episode_id, air_date, votes in rows]
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS episodes_show_air_date ON episodes (show, air_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS episodes_rating ON episodes (rating)")
+    print(f"Normalized air dates and votes of {len(rows)} episodes")
+
+
+# version 2: the shows catalogue, starting with the shows that used to be hardcoded in the scraper
+def seed_shows(conn):
+    conn.executemany(
+        "INSERT OR IGNORE INTO shows (title_id, name, seasons) VALUES (?, ?, ?)", INITIAL_SHOWS
+    )
+
+
+MIGRATIONS = {
+    1: normalize_episode_fields,
+    2: seed_shows,
+}
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        with conn:
+            MIGRATIONS[target](conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            bump_data_version(conn)
+    if version < SCHEMA_VERSION:
+        # statistics let the planner use the composite indexes for season-only or date-only filters too
+        conn.execute("ANALYZE")
+
+
+# Create the episodes table and bring an existing one up to date; safe to run on every start
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS episodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            show TEXT,
+            season INTEGER,
+            episode INTEGER,
+            episode_title TEXT,
+            air_date TEXT,
+            rating REAL,
+            votes INTEGER,
+            plot TEXT,
+            image TEXT
+        )
+    ''')
+
+    # databases created by older versions of the scraper have no image column
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(episodes)")}
+    if 'image' not in columns:
+        conn.execute("ALTER TABLE episodes ADD COLUMN image TEXT")
+
+    # full-text index over titles and plots, kept in sync by triggers on episodes
+    ensure_fts_index(conn)
+
+    # one row per episode: older versions of the scraper inserted a new copy on every run
+    has_unique_key = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'episodes_show_season_episode'"
+    ).fetchone()
+    if not has_unique_key:
+        with conn:
+            removed = conn.execute('''
+                DELETE FROM episodes
+                WHERE id NOT IN (SELECT MAX(id) FROM episodes GROUP BY show, season, episode)
+            ''').rowcount
+            conn.execute('''
+                CREATE UNIQUE INDEX episodes_show_season_episode ON episodes (show, season, episode)
+            ''')
+        if removed:
+            print(f"Removed {removed} duplicate episode rows")
+
+    # what the scraper last saw on each season page, so unchanged seasons can be skipped
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            url TEXT PRIMARY KEY,
+            show TEXT,
+            season INTEGER,
+            fetched_at TEXT,
+            content_hash TEXT,
+            episode_count INTEGER,
+            status TEXT
+        )
+    ''')
+
+    # the shows the scraper crawls; seasons is discovered from the show's episodes page
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shows (
+            title_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            seasons INTEGER,
+            seasons_checked_at TEXT
+        )
+    ''')
+
+    migrate(conn)
+
+    # readers (the Dash app) keep working while the scraper writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.commit()
+
+
+def create_schema(db_file):
+    conn = sqlite3.connect(db_file)
+    ensure_schema(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    create_schema("episodes.db")
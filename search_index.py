@@ -0,0 +1,230 @@
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import db
+
+# how often (in seconds) a loaded index checks for a newer version or a changed episodes table
+INDEX_CHECK_INTERVAL = 30
+# rebuild a stale index on the spot; turned off when serving (serve.py), where workers only follow
+# the versions the scraper or `serve.py --prepare` publish
+AUTO_REBUILD = os.environ.get("EPISODES_INDEX_AUTO_REBUILD", "1") != "0"
+# published versions kept on disk; older ones are deleted, workers switch at their next check
+KEEP_VERSIONS = 2
+
+
+# the index lives in a directory next to the database, e.g. episodes.db -> episodes_index/
+def default_index_dir(db_file):
+    return os.path.splitext(db_file)[0] + "_index"
+
+
+# Versioned directories: every build goes into its own subdirectory of root, and root/CURRENT names
+# the live one. Publishing replaces CURRENT in one rename, so a reader in any process sees either
+# the old build or the new one, never a half-written one.
+def current_version(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# a fresh directory to build a new version in
+def new_version_dir(root):
+    version = f"v{time.time_ns()}_{os.getpid()}"
+    path = os.path.join(root, version + ".tmp")
+    os.makedirs(path)
+    return path, version
+
+
+def publish_version(root, build_dir, version):
+    os.rename(build_dir, os.path.join(root, version))
+    pointer = os.path.join(root, f"CURRENT.{os.getpid()}.tmp")
+    with open(pointer, "w") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+
+    versions = sorted(
+        name for name in os.listdir(root)
+        if name.startswith("v") and not name.endswith(".tmp") and os.path.isdir(os.path.join(root, name))
+    )
+    for old in versions[:-KEEP_VERSIONS]:
+        if old != version:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+# a cheap fingerprint of the episodes table, used to decide whether the index is stale
+def episodes_signature(conn):
+    row = conn.execute(
+        "SELECT COUNT(*), MAX(id), TOTAL(LENGTH(episode_title)), TOTAL(LENGTH(plot)) FROM episodes"
+    ).fetchone()
+    return list(row)
+
+
+# the signature of the episodes as they are now, read through the app's connection pool
+def _current_signature(db_file):
+    with db.connection(db_file) as conn:
+        return episodes_signature(conn)
+
+
+class SearchIndex:
+    def __init__(self, ids, matrix, vectorizer, signature, db_file, version=None, postings=None):
+        self.ids = ids
+        self.matrix = matrix
+        # the same matrix column by column (the postings list of every term), for the typeahead
+        self.postings = postings
+        self.vectorizer = vectorizer
+        self.signature = signature
+        self.db_file = db_file
+        self.version = version
+        self.checked_at = time.time()
+
+    # returns the scores of every indexed episode for the query (cosine, rows are l2-normalized)
+    def score(self, query):
+        query_vec = self.vectorizer.transform([query])
+        return np.asarray((self.matrix @ query_vec.T).todense()).ravel()
+
+    # rank the given episode ids (or all of them) by similarity to the query
+    def rank(self, query, ids=None):
+        scores = self.score(query)
+        if ids is not None:
+            mask = np.isin(self.ids, np.asarray(ids))
+            row_ids = self.ids[mask]
+            scores = scores[mask]
+        else:
+            row_ids = self.ids
+        order = np.argsort(-scores, kind='stable')
+        return row_ids[order], scores[order]
+
+    def is_stale(self):
+        return _current_signature(self.db_file) != self.signature
+
+
+# fit the vectorizer once over every episode and publish it as a new version of the index
+def build_index(db_file=None, index_dir=None):
+    db_file = db_file or db.DB_FILE
+    index_dir = index_dir or default_index_dir(db_file)
+
+    conn = sqlite3.connect(db_file)
+    # one read transaction, so the signature matches the rows that get indexed
+    with conn:
+        conn.execute("BEGIN")
+        signature = episodes_signature(conn)
+        rows = conn.execute("SELECT id, episode_title, plot FROM episodes ORDER BY id").fetchall()
+    conn.close()
+
+    # imported here rather than at the top: scikit-learn takes over a second to import, and the
+    # app only needs it once a search comes in
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    # same text the search box used to build on the fly: title + plot
+    docs = [f"{row[1] or ''} {row[2] or ''}" for row in rows]
+
+    vectorizer = TfidfVectorizer(stop_words='english')
+    matrix = vectorizer.fit_transform(docs).tocsr()
+    matrix.sort_indices()
+    # stop_words_ is only needed for introspection and makes the pickle much larger
+    if hasattr(vectorizer, 'stop_words_'):
+        del vectorizer.stop_words_
+
+    tmp_dir, version = new_version_dir(index_dir)
+    np.save(os.path.join(tmp_dir, "ids.npy"), ids)
+    np.save(os.path.join(tmp_dir, "data.npy"), matrix.data)
+    np.save(os.path.join(tmp_dir, "indices.npy"), matrix.indices)
+    np.save(os.path.join(tmp_dir, "indptr.npy"), matrix.indptr)
+    postings = matrix.tocsc()
+    postings.sort_indices()
+    np.save(os.path.join(tmp_dir, "postings_data.npy"), postings.data)
+    np.save(os.path.join(tmp_dir, "postings_indices.npy"), postings.indices)
+    np.save(os.path.join(tmp_dir, "postings_indptr.npy"), postings.indptr)
+    with open(os.path.join(tmp_dir, "vectorizer.pkl"), "wb") as f:
+        pickle.dump(vectorizer, f)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"signature": signature, "shape": list(matrix.shape)}, f)
+
+    publish_version(index_dir, tmp_dir, version)
+    print(f"Built search index for {len(ids)} episodes in {os.path.join(index_dir, version)}")
+
+
+# memory-map the current version of the index, building it first if it is missing or out of date
+def load_index(db_file=None, index_dir=None, rebuild_if_stale=True):
+    db_file = db_file or db.DB_FILE
+    index_dir = index_dir or default_index_dir(db_file)
+
+    if current_version(index_dir) is None:
+        build_index(db_file, index_dir)
+    version = current_version(index_dir)
+    with open(os.path.join(index_dir, version, "meta.json")) as f:
+        meta = json.load(f)
+    if rebuild_if_stale and meta["signature"] != _current_signature(db_file):
+        build_index(db_file, index_dir)
+        version = current_version(index_dir)
+        with open(os.path.join(index_dir, version, "meta.json")) as f:
+            meta = json.load(f)
+    version_dir = os.path.join(index_dir, version)
+    from scipy import sparse
+
+    def load(name):
+        return np.load(os.path.join(version_dir, name), mmap_mode='r')
+
+    matrix = sparse.csr_matrix(
+        (load("data.npy"), load("indices.npy"), load("indptr.npy")),
+        shape=tuple(meta["shape"]),
+        copy=False
+    )
+    postings = None
+    # indexes built before the postings were stored get them from Typeahead instead
+    if os.path.exists(os.path.join(version_dir, "postings_indptr.npy")):
+        postings = sparse.csc_matrix(
+            (load("postings_data.npy"), load("postings_indices.npy"), load("postings_indptr.npy")),
+            shape=tuple(meta["shape"]),
+            copy=False
+        )
+    with open(os.path.join(version_dir, "vectorizer.pkl"), "rb") as f:
+        vectorizer = pickle.load(f)
+
+    return SearchIndex(
+        np.asarray(load("ids.npy")), matrix, vectorizer, meta["signature"], db_file, version, postings
+    )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# whether a loaded index is due for a check for a newer version
+def _due(loaded, db_file):
+    return loaded is None or loaded.db_file != db_file or time.time() - loaded.checked_at > INDEX_CHECK_INTERVAL
+
+
+# the index shared by the app; at most every INDEX_CHECK_INTERVAL seconds it switches to a newly
+# published version, or (with AUTO_REBUILD) rebuilds when the episodes table changed. Only one
+# thread checks and rebuilds at a time; the others wait for its result instead of each fitting
+# their own index.
+def get_search_index(db_file=None):
+    global _index
+    db_file = db_file or db.DB_FILE
+    if not _due(_index, db_file):
+        return _index
+    with _index_lock:
+        if _index is None or _index.db_file != db_file:
+            _index = load_index(db_file, rebuild_if_stale=AUTO_REBUILD)
+        elif time.time() - _index.checked_at > INDEX_CHECK_INTERVAL:
+            if current_version(default_index_dir(db_file)) != _index.version:
+                _index = load_index(db_file, rebuild_if_stale=False)
+            elif AUTO_REBUILD and _index.is_stale():
+                _index = load_index(db_file)
+            else:
+                _index.checked_at = time.time()
+        return _index
+
+
+if __name__ == "__main__":
+    build_index()
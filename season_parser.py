@@ -0,0 +1,177 @@
+# Parsing of IMDb season pages, kept free of the scraper's network and database code so the
+# scraper's parse workers (separate processes) only import what they need
+import html
+import json
+import re
+from datetime import date
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from episode_fields import parse_air_date, parse_votes
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# while parsing, the strainer sees the raw class attribute ("sc-... episode-item-wrapper"), so the
+# class is matched as a word rather than as one of the split class names
+EPISODE_CARD_CLASS = re.compile(r'(^|\s)episode-item-wrapper(\s|$)')
+EPISODE_CARDS = SoupStrainer('article', class_=EPISODE_CARD_CLASS)
+
+
+# Extract the episodes from the rendered episode cards of a season page
+#
+# only the episode cards are turned into a tree; the rest of the page is skipped while parsing
+def parse_episodes_from_markup(page_source):
+    soup = BeautifulSoup(page_source, HTML_PARSER, parse_only=EPISODE_CARDS)
+
+    parsed = []
+    episodes = soup.find_all('article', class_=EPISODE_CARD_CLASS)
+    for episode in episodes:
+        # Extract episode metadata
+        episode_title_tag = episode.find('div', class_='ipc-title__text')
+        episode_title = episode_title_tag.text.strip() if episode_title_tag else "N/A"
+
+        air_date_tag = episode.find('span', class_='sc-f2169d65-10 bYaARM')
+        air_date = parse_air_date(air_date_tag.text) if air_date_tag else None
+
+        rating_tag = episode.find('span', class_='ipc-rating-star--rating')
+        rating = float(rating_tag.text.strip()) if rating_tag else None
+
+        votes_tag = episode.find('span', class_='ipc-rating-star--voteCount')
+        votes = parse_votes(votes_tag.text) if votes_tag else None
+
+        plot_tag = episode.find('div', class_='ipc-html-content-inner-div')
+        plot = plot_tag.text.strip() if plot_tag else "N/A"
+
+        image_tag = episode.find('img', class_='ipc-image')
+        image = image_tag.get('src') if image_tag else None
+
+        # Parse season and episode numbers
+        episode_info = episode_title.split('∙')[0].strip() if '∙' in episode_title else "S0.E0"
+        season, episode_number = map(int, episode_info.replace('S', '').replace('E', '').split('.'))
+
+        parsed.append({
+            'season': season,
+            'episode': episode_number,
+            'episode_title': episode_title,
+            'air_date': air_date,
+            'rating': rating,
+            'votes': votes,
+            'plot': plot,
+            'image': image,
+        })
+    return parsed
+
+
+NEXT_DATA_PATTERN = re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.S)
+
+
+# the episode list IMDb embeds as JSON in the page, found by shape so small layout changes don't break it
+def find_episode_items(data):
+    if isinstance(data, dict):
+        items = data.get('episodes', {}).get('items') if isinstance(data.get('episodes'), dict) else None
+        if isinstance(items, list):
+            return items
+        children = data.values()
+    elif isinstance(data, list):
+        children = data
+    else:
+        return None
+    for child in children:
+        items = find_episode_items(child)
+        if items is not None:
+            return items
+    return None
+
+
+# Extract the episodes from the JSON embedded in the page (__NEXT_DATA__), no rendering needed
+def parse_episodes_from_json(page_source):
+    match = NEXT_DATA_PATTERN.search(page_source)
+    if not match:
+        return []
+    try:
+        items = find_episode_items(json.loads(match.group(1))) or []
+    except ValueError:
+        return []
+
+    parsed = []
+    for item in items:
+        try:
+            season, episode_number = int(item['season']), int(item['episode'])
+        except (KeyError, TypeError, ValueError):
+            season, episode_number = 0, 0
+
+        release = item.get('releaseDate') or {}
+        try:
+            air_date = date(release['year'], release['month'], release['day']).isoformat()
+        except (KeyError, TypeError, ValueError):
+            air_date = None
+
+        parsed.append({
+            'season': season,
+            'episode': episode_number,
+            'episode_title': f"S{season}.E{episode_number} ∙ {item.get('titleText') or 'N/A'}",
+            'air_date': air_date,
+            'rating': item.get('aggregateRating'),
+            'votes': item.get('voteCount'),
+            'plot': item.get('plot') or "N/A",
+            'image': (item.get('image') or {}).get('url'),
+        })
+    return parsed
+
+
+# Prefer the embedded JSON, fall back to the rendered markup
+def parse_season_page(page_source):
+    return parse_episodes_from_json(page_source) or parse_episodes_from_markup(page_source)
+
+
+# the season list IMDb embeds in the page (section.seasons: [{"value": "1"}, ...])
+def find_season_values(data):
+    if isinstance(data, dict):
+        seasons = data.get('seasons')
+        if isinstance(seasons, list) and seasons and all(isinstance(s, dict) and 'value' in s for s in seasons):
+            return [season['value'] for season in seasons]
+        children = data.values()
+    elif isinstance(data, list):
+        children = data
+    else:
+        return None
+    for child in children:
+        values = find_season_values(child)
+        if values is not None:
+            return values
+    return None
+
+
+SEASON_LINK_PATTERN = re.compile(r'[?&;]season=(\d+)')
+
+
+# The season numbers a show's episodes page lists, from the embedded JSON or else the season links
+def parse_season_numbers(page_source):
+    match = NEXT_DATA_PATTERN.search(page_source)
+    if match:
+        try:
+            values = find_season_values(json.loads(match.group(1))) or []
+        except ValueError:
+            values = []
+        # "Unknown" collects episodes without a season; there is no season page for it
+        seasons = sorted({int(value) for value in values if str(value).isdigit()})
+        if seasons:
+            return seasons
+    return sorted({int(season) for season in SEASON_LINK_PATTERN.findall(page_source)})
+
+
+TITLE_PATTERN = re.compile(r'<title>(.*?)</title>', re.S)
+
+
+# The show's name from the page title, e.g. "Family Guy (TV Series 1999- ) - Episode list - IMDb"
+def parse_show_name(page_source):
+    match = TITLE_PATTERN.search(page_source)
+    if not match:
+        return None
+    title = html.unescape(match.group(1)).strip()
+    name = re.split(r' \(| - ', title, maxsplit=1)[0].strip()
+    return name or None
@@ -0,0 +1,112 @@
+# Production serving: the Dash app on gunicorn with several worker processes
+#
+# `python serve.py` prepares everything the app reads once (schema, similar episodes, summary
+# statistics, search index, embeddings, snapshot), loads the app in the gunicorn master and forks
+# the workers from it. The indexes are memory-mapped .npy files, so all workers share one copy through the page cache
+# instead of each building its own. Workers never rebuild anything themselves: the scraper (or
+# `python serve.py --prepare`) publishes new index versions, and each worker switches to them at
+# its next check, at most search_index.INDEX_CHECK_INTERVAL seconds later.
+#
+#   python serve.py --workers 4 --bind 0.0.0.0:8050
+#   python serve.py --prepare          # after changing the database by hand
+import argparse
+import os
+
+import db
+import search_index
+import similar_episodes
+from embeddings import default_embeddings_dir, load_embeddings
+from episode_stats import get_episode_stats, refresh_episode_stats
+from schema import create_schema
+from snapshot import export_snapshot
+
+
+# Whether the embeddings of db_file are kept up to date: when the search box or similar panel is
+# configured to read them, or once any earlier run has published them. The scraper usually runs
+# without the server's environment, and must still keep the server's embeddings current.
+def uses_embeddings(db_file=None):
+    return (os.environ.get("EPISODES_SEARCH_BACKEND") == "semantic"
+            or similar_episodes.SIMILAR_BACKEND == "embeddings"
+            or search_index.current_version(default_embeddings_dir(db_file or db.DB_FILE)) is not None)
+
+
+# Bring everything the app reads up to date and publish new versions of what changed
+def prepare(db_file=None, shows=None):
+    db_file = db_file or db.DB_FILE
+    create_schema(db_file)
+    similar_episodes.refresh_similar_episodes(db_file, shows)
+    refresh_episode_stats(db_file)
+    search_index.load_index(db_file)
+    if uses_embeddings(db_file):
+        load_embeddings(db_file)
+    export_snapshot(db_file)
+    # connections must not be inherited by forked workers
+    db.close_all()
+
+
+def run_gunicorn(server, options):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("serve.py runs the app on gunicorn: pip install gunicorn (or use `python ui.py`)")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return server
+
+    Application().run()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the episode browser with gunicorn.")
+    parser.add_argument("--db", default=db.DB_FILE, help="database to serve (default: $EPISODES_DB or episodes.db)")
+    parser.add_argument("--bind", default="127.0.0.1:8050", help="address to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    parser.add_argument("--timeout", type=int, default=60, help="seconds before a stuck worker is restarted")
+    parser.add_argument("--prepare", action="store_true", help="only prepare and publish the indexes, then exit")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db.configure(args.db)
+    prepare(args.db)
+    if args.prepare:
+        return
+
+    # workers follow published versions instead of rebuilding or refreshing on their own
+    search_index.AUTO_REBUILD = False
+    similar_episodes.BACKGROUND_REFRESH = False
+    # the master loads everything below before forking; a warm-up thread must not be forked
+    import startup
+    startup.WARM_UP = False
+
+    import ui
+    from typeahead import get_typeahead
+
+    # load (map) the indexes in the master, so every forked worker starts with them
+    search_index.get_search_index()
+    get_episode_stats()
+    if ui.SEARCH_BACKEND == "typeahead":
+        get_typeahead()
+    if uses_embeddings(args.db):
+        ui.get_embedding_index()
+    db.close_all()
+
+    run_gunicorn(ui.app.server, {
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "timeout": args.timeout,
+        "preload_app": True,
+    })
+
+
+if __name__ == "__main__":
+    main()
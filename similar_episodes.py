@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import db
+from embeddings import get_embedding_index
+
+# how many neighbors are stored per episode
+TOP_K = 3
+# rows of the similarity matrix computed at a time, keeps memory bounded for big shows
+CHUNK_SIZE = 512
+# "tfidf": per-show TF-IDF cosine, "embeddings": nearest neighbors in the LSA embedding index
+SIMILAR_BACKEND = os.environ.get("EPISODES_SIMILAR_BACKEND", "tfidf")
+# how often (in seconds) the app checks for shows whose neighbors are out of date
+REFRESH_CHECK_INTERVAL = 30
+# off when serving with several workers (serve.py): the scraper refreshes after every scrape
+BACKGROUND_REFRESH = os.environ.get("EPISODES_BACKGROUND_REFRESH", "1") != "0"
+
+
+def create_similar_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS similar_episodes (
+            episode_id INTEGER,
+            neighbor_id INTEGER,
+            score REAL,
+            rank INTEGER,
+            PRIMARY KEY (episode_id, rank)
+        )
+    ''')
+    # remembers what each show looked like when its neighbors were computed
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS similar_episodes_state (
+            show TEXT PRIMARY KEY,
+            signature TEXT
+        )
+    ''')
+
+
+def show_signatures(conn):
+    rows = conn.execute('''
+        SELECT show, COUNT(*), MAX(id), TOTAL(LENGTH(plot))
+        FROM episodes
+        GROUP BY show
+    ''').fetchall()
+    return {row[0]: ",".join(str(value) for value in row[1:]) for row in rows}
+
+
+# top-k neighbors of every episode of one show, from a single batched sparse product
+def compute_show_neighbors(ids, plots, top_k=TOP_K):
+    if len(ids) < 2:
+        return []
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(stop_words='english')
+    try:
+        tfidf_matrix = vectorizer.fit_transform(plots)
+    except ValueError:
+        # every plot is empty or only stop words
+        return []
+
+    k = min(top_k, len(ids) - 1)
+    neighbors = []
+    for start in range(0, len(ids), CHUNK_SIZE):
+        # rows are l2-normalized, so the dot product is the cosine similarity
+        scores = (tfidf_matrix[start:start + CHUNK_SIZE] @ tfidf_matrix.T).toarray()
+        rows = np.arange(scores.shape[0])
+        scores[rows, rows + start] = -np.inf  # an episode is not its own neighbor
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for row in rows:
+            episode_id = ids[start + row]
+            for rank in range(k):
+                neighbors.append((episode_id, ids[top[row, rank]], float(top_scores[row, rank]), rank + 1))
+    return neighbors
+
+
+# top-k neighbors of every episode of one show, looked up in the embedding index
+def compute_show_neighbors_from_embeddings(ids, index, top_k=TOP_K):
+    neighbors = []
+    # the show's rows, found once rather than for every episode
+    show = index.subset(ids)
+    for episode_id in ids:
+        if episode_id not in index.rows_by_id:
+            continue
+        neighbor_ids, scores = index.neighbors(episode_id, top_k, subset=show)
+        for rank, (neighbor_id, score) in enumerate(zip(neighbor_ids, scores)):
+            neighbors.append((episode_id, int(neighbor_id), float(score), rank + 1))
+    return neighbors
+
+
+# recompute the neighbor table for the shows that changed since the last run
+def refresh_similar_episodes(db_file=None, shows=None, top_k=TOP_K, backend=None):
+    db_file = db_file or db.DB_FILE
+    backend = backend or SIMILAR_BACKEND
+    conn = sqlite3.connect(db_file)
+    create_similar_tables(conn)
+
+    signatures = show_signatures(conn)
+    if backend != "tfidf":
+        # switching backends recomputes every show
+        signatures = {show: f"{backend}:{signature}" for show, signature in signatures.items()}
+    stored = dict(conn.execute("SELECT show, signature FROM similar_episodes_state").fetchall())
+    if shows is None:
+        shows = signatures.keys()
+    stale = [show for show in shows if signatures.get(show) != stored.get(show)]
+
+    for show in stale:
+        rows = conn.execute("SELECT id, plot FROM episodes WHERE show = ? ORDER BY id", (show,)).fetchall()
+        ids = [row[0] for row in rows]
+        if backend == "embeddings":
+            neighbors = compute_show_neighbors_from_embeddings(ids, get_embedding_index(db_file), top_k)
+        else:
+            neighbors = compute_show_neighbors(ids, [row[1] or '' for row in rows], top_k)
+
+        with conn:
+            conn.execute('''
+                DELETE FROM similar_episodes
+                WHERE episode_id IN (SELECT id FROM episodes WHERE show = ?)
+            ''', (show,))
+            conn.executemany('''
+                INSERT OR REPLACE INTO similar_episodes (episode_id, neighbor_id, score, rank)
+                VALUES (?, ?, ?, ?)
+            ''', neighbors)
+            conn.execute('''
+                INSERT OR REPLACE INTO similar_episodes_state (show, signature) VALUES (?, ?)
+            ''', (show, signatures.get(show)))
+        print(f"Computed similar episodes for {show} ({len(ids)} episodes)")
+
+    # neighbors of episodes that no longer exist
+    with conn:
+        conn.execute("DELETE FROM similar_episodes WHERE episode_id NOT IN (SELECT id FROM episodes)")
+    conn.close()
+    return stale
+
+
+# a single background worker, so refreshes never overlap and never run on a request thread
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similar-refresh")
+_refresh_lock = threading.Lock()
+_refresh_future = None
+_refresh_checked_at = 0.0
+
+
+# start a refresh on the background worker, at most every REFRESH_CHECK_INTERVAL seconds
+def refresh_similar_episodes_in_background(db_file=None):
+    global _refresh_future, _refresh_checked_at
+    if not BACKGROUND_REFRESH:
+        return None
+    with _refresh_lock:
+        if _refresh_future is not None and not _refresh_future.done():
+            return _refresh_future
+        if time.monotonic() - _refresh_checked_at < REFRESH_CHECK_INTERVAL:
+            return _refresh_future
+        _refresh_checked_at = time.monotonic()
+        _refresh_future = _refresh_executor.submit(refresh_similar_episodes, db_file)
+        return _refresh_future
+
+
+# neighbors for a whole page of episodes in one indexed lookup: {episode_id: [neighbor rows]}
+def fetch_similar_episodes(episode_ids, db_file=None):
+    episode_ids = [int(episode_id) for episode_id in episode_ids]
+    similar = {episode_id: [] for episode_id in episode_ids}
+    if not episode_ids:
+        return similar
+
+    try:
+        with db.connection(db_file) as conn:
+            rows = conn.execute('''
+                SELECT s.episode_id, s.score, e.id, e.episode_title, e.air_date
+                FROM similar_episodes s
+                JOIN episodes e ON e.id = s.neighbor_id
+                WHERE s.episode_id IN (SELECT value FROM json_each(?))
+                ORDER BY s.episode_id, s.rank
+            ''', (json.dumps(episode_ids),)).fetchall()
+    except sqlite3.OperationalError:
+        # no neighbor table until the first refresh has run (the app no longer refreshes at import)
+        return similar
+
+    for row in rows:
+        similar[row['episode_id']].append(dict(row))
+    return similar
+
+
+if __name__ == "__main__":
+    refresh_similar_episodes()
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+from urllib.parse import quote
+
+import db
+from schema import get_data_version
+from search_index import current_version, new_version_dir, publish_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# episode columns and their Arrow types; air_date is stored as a real date
+COLUMNS = {
+    'id': 'int64',
+    'show': 'string',
+    'season': 'int32',
+    'episode': 'int32',
+    'episode_title': 'string',
+    'air_date': 'date32',
+    'rating': 'float64',
+    'votes': 'int64',
+    'plot': 'string',
+    'image': 'string',
+}
+
+
+# the snapshot lives next to the database, e.g. episodes.db -> episodes_snapshot/, in versioned
+# directories like the search index (see search_index.current_version)
+def default_snapshot_dir(db_file):
+    return os.path.splitext(db_file)[0] + "_snapshot"
+
+
+# the current version's directory and its meta.json, or (None, None) before the first export
+def _read_meta(snapshot_dir):
+    version = current_version(snapshot_dir)
+    if version is None:
+        return None, None
+    version_dir = os.path.join(snapshot_dir, version)
+    with open(os.path.join(version_dir, "meta.json")) as f:
+        return version_dir, json.load(f)
+
+
+def _show_table(rows):
+    arrays = []
+    for i, (name, arrow_type) in enumerate(COLUMNS.items()):
+        values = [row[i] for row in rows]
+        if arrow_type == 'date32':
+            arrays.append(pa.array(values, pa.string()).cast(pa.date32()))
+        else:
+            arrays.append(pa.array(values, getattr(pa, arrow_type)()))
+    return pa.Table.from_arrays(arrays, names=list(COLUMNS))
+
+
+# Write the episodes as one Arrow IPC (Feather v2) file per show
+#
+# the files are uncompressed so they can be memory-mapped and read without copying; the snapshot is
+# only rewritten when the data version changed since the last export
+def export_snapshot(db_file=None, snapshot_dir=None, force=False):
+    if pa is None:
+        print("pyarrow is not installed, skipping the snapshot export")
+        return False
+    db_file = db_file or db.DB_FILE
+    snapshot_dir = snapshot_dir or default_snapshot_dir(db_file)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        # one read transaction, so every show comes from the same version of the data
+        conn.execute("BEGIN")
+        data_version = get_data_version(conn)
+        _, meta = _read_meta(snapshot_dir)
+        if not force and meta is not None and meta["data_version"] == data_version:
+            return False
+
+        shows = [row[0] for row in conn.execute("SELECT DISTINCT show FROM episodes ORDER BY show")]
+        tables = {}
+        for show in shows:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM episodes WHERE show = ? ORDER BY season, episode", (show,)
+            ).fetchall()
+            tables[show] = _show_table(rows)
+    finally:
+        conn.close()
+
+    # a new version, published in one rename once every file is written
+    tmp_dir, version = new_version_dir(snapshot_dir)
+    files = {}
+    for show, table in tables.items():
+        files[show] = f"show={quote(show, safe='')}.arrow"
+        with pa.OSFile(os.path.join(tmp_dir, files[show]), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"data_version": data_version, "shows": files, "rows": sum(map(len, tables.values()))}, f)
+
+    publish_version(snapshot_dir, tmp_dir, version)
+    print(f"Exported {sum(map(len, tables.values()))} episodes of {len(tables)} shows to "
+          f"{os.path.join(snapshot_dir, version)}")
+    return True
+
+
+# The snapshot as an Arrow table, reading only the given columns of the given shows
+#
+# the files are memory-mapped, so columns that aren't selected are never read from disk and the
+# selected ones are not copied
+def load_table(columns=None, shows=None, db_file=None, snapshot_dir=None):
+    if pa is None:
+        raise ImportError("loading the snapshot needs pyarrow")
+    snapshot_dir = snapshot_dir or default_snapshot_dir(db_file or db.DB_FILE)
+    version_dir, meta = _read_meta(snapshot_dir)
+    if meta is None:
+        raise FileNotFoundError(f"no snapshot in {snapshot_dir}, run `python snapshot.py` first")
+
+    files = meta["shows"]
+    if shows is not None:
+        files = {show: files[show] for show in shows if show in files}
+
+    tables = []
+    for file_name in files.values():
+        source = pa.memory_map(os.path.join(version_dir, file_name), "r")
+        table = pa.ipc.open_file(source).read_all()
+        tables.append(table.select(columns) if columns else table)
+
+    if not tables:
+        schema = pa.schema([(name, getattr(pa, arrow_type)()) for name, arrow_type in COLUMNS.items()])
+        return schema.empty_table().select(columns) if columns else schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+# same as load_table, as a pandas DataFrame (air_date as datetime64)
+def load_frame(columns=None, shows=None, db_file=None, snapshot_dir=None):
+    return load_table(columns, shows, db_file, snapshot_dir).to_pandas(date_as_object=False)
+
+
+if __name__ == "__main__":
+    export_snapshot(force=True)
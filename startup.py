@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+import time
+
+# warm the app up in the background after it starts; with 0, everything loads on first use
+WARM_UP = os.environ.get("EPISODES_WARM_UP", "1") != "0"
+
+STARTED = time.perf_counter()
+
+# (phase, seconds) in the order they happened, e.g. imports, schema, warm-up steps
+phases = []
+ready = threading.Event()
+_last_mark = STARTED
+_lock = threading.Lock()
+
+
+def _record(name, seconds):
+    with _lock:
+        phases.append((name, round(seconds, 4)))
+
+
+# close a phase of the startup that began at the previous mark
+def mark(name):
+    global _last_mark
+    now = time.perf_counter()
+    _record(name, now - _last_mark)
+    _last_mark = now
+
+
+def report():
+    total = time.perf_counter() - STARTED
+    lines = [f"  {name:<28} {seconds * 1000:>9.1f} ms" for name, seconds in phases]
+    print("Startup:\n" + "\n".join(lines) + f"\n  {'ready after':<28} {total * 1000:>9.1f} ms", flush=True)
+
+
+# Run the warm-up steps on a background thread, then report ready
+#
+# each step is (name, fn); a failing step is reported and skipped, since everything it would have
+# loaded also loads on first use
+def start_warm_up(steps):
+    if not WARM_UP:
+        ready.set()
+        return None
+
+    def run():
+        for name, fn in steps:
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                print(f"Warm-up step {name} failed: {e!r}", flush=True)
+            _record(f"warm-up: {name}", time.perf_counter() - start)
+        ready.set()
+        report()
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+# /healthz: 503 while warming up, 200 once ready, with the startup breakdown either way
+def register_health_route(server):
+    from flask import Response
+
+    @server.route("/healthz")
+    def healthz():
+        body = {
+            "status": "ready" if ready.is_set() else "warming up",
+            "uptime_seconds": round(time.perf_counter() - STARTED, 3),
+            "startup": dict(phases),
+        }
+        return Response(json.dumps(body), status=200 if ready.is_set() else 503, mimetype="application/json")
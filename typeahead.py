@@ -0,0 +1,146 @@
+import bisect
+import re
+
+import numpy as np
+
+from cache import LRUCache
+from search_index import get_search_index
+
+# the last word of a query is matched as a prefix once it has this many characters
+MIN_PREFIX = 2
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+# search-as-you-type on top of the prebuilt TF-IDF index
+#
+# every complete word of the query must appear in an episode, and the word being typed matches
+# any indexed term it is a prefix of ("hom" -> homer, home, homework...). Terms are looked up in a
+# sorted term dictionary and scored from the index's postings (its columns). Each query's
+# matches are remembered, and a query that extends an earlier one ("home a" -> "home al") can
+# only match fewer episodes, so it only re-scores the earlier query's matches.
+class Typeahead:
+    def __init__(self, index):
+        self.index = index
+        self.version = index.version
+        self.n_rows = index.matrix.shape[0]
+        vocabulary = index.vectorizer.vocabulary_
+        self.terms = sorted(vocabulary)
+        self.term_columns = np.array([vocabulary[term] for term in self.terms], dtype=np.int64)
+        self.vocabulary = vocabulary
+        self.stop_words = frozenset(index.vectorizer.get_stop_words() or ())
+        # the postings list of every term, memory-mapped from the index like the matrix itself
+        self.postings = index.postings if index.postings is not None else index.matrix.tocsc()
+        self._matches = LRUCache(maxsize=1024, ttl=600)
+
+    # the columns of every term starting with prefix
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\uffff")
+        return self.term_columns[start:end]
+
+    # (complete words, prefix being typed) of a query, normalized the way the vectorizer sees text
+    def parse(self, query):
+        words = WORD_PATTERN.findall(query.lower())
+        prefix = None
+        if words and not query[-1:].isspace():
+            prefix = words.pop()
+            if len(prefix) < MIN_PREFIX:
+                prefix = None
+        complete = tuple(word for word in words if len(word) > 1 and word not in self.stop_words)
+        return complete, prefix
+
+    # one group of columns per word; an episode has to match every group. None: nothing can match
+    def groups(self, parsed):
+        complete, prefix = parsed
+        groups = []
+        for word in complete:
+            if word not in self.vocabulary:
+                return None
+            groups.append(np.array([self.vocabulary[word]]))
+        if prefix:
+            columns = self.expand(prefix)
+            if len(columns) == 0:
+                return None
+            groups.append(columns)
+        return groups
+
+    # True when every episode matching `parsed` also matches `previous`
+    @staticmethod
+    def narrows(previous, parsed):
+        previous_complete, previous_prefix = previous
+        complete, prefix = parsed
+        if not set(previous_complete) <= set(complete):
+            return False
+        if previous_prefix is None:
+            return True
+        return any(word.startswith(previous_prefix) for word in (*complete, prefix) if word)
+
+    def _group_weights(self, columns, rows=None):
+        if rows is None:
+            postings = self.postings[:, columns]
+            return np.bincount(postings.indices, weights=postings.data, minlength=self.n_rows)
+        return np.asarray(self.index.matrix[rows][:, columns].sum(axis=1)).ravel()
+
+    # rows matching every group and their scores, optionally only among `rows`
+    def _match(self, groups, rows=None):
+        size = self.n_rows if rows is None else len(rows)
+        scores = np.zeros(size)
+        matched = np.ones(size, dtype=bool)
+        for columns in groups:
+            weights = self._group_weights(columns, rows)
+            matched &= weights > 0
+            scores += weights
+        if rows is None:
+            rows = np.arange(self.n_rows)
+        return rows[matched], scores[matched]
+
+    # the rows matching a query and their scores, narrowed from the longest earlier query it extends
+    def matches(self, query):
+        key = " ".join(query.lower().split()) + (" " if query[-1:].isspace() else "")
+        cached = self._matches.get(key)
+        if cached is not None:
+            return cached[1], cached[2]
+
+        parsed = self.parse(query)
+        groups = self.groups(parsed)
+        if groups is None:
+            rows, scores = np.array([], dtype=np.int64), np.array([])
+        else:
+            candidates = None
+            for end in range(len(key) - 1, 0, -1):
+                previous = self._matches.get(key[:end])
+                if previous is not None and self.narrows(previous[0], parsed):
+                    candidates = previous[1]
+                    break
+            rows, scores = self._match(groups, candidates)
+
+        self._matches.set(key, (parsed, rows, scores))
+        return rows, scores
+
+    # same interface as SearchIndex.rank: the given episode ids (or all) that match, best first
+    def rank(self, query, ids=None):
+        parsed = self.parse(query)
+        if not parsed[0] and not parsed[1]:
+            # nothing searchable typed yet (e.g. a single letter): keep the given order
+            return self.index.rank("", ids)
+
+        rows, scores = self.matches(query)
+        row_ids = self.index.ids[rows]
+        if ids is not None:
+            mask = np.isin(row_ids, np.asarray(ids))
+            row_ids, scores = row_ids[mask], scores[mask]
+        order = np.argsort(-scores, kind='stable')
+        return row_ids[order], scores[order]
+
+
+_typeahead = None
+
+
+# the typeahead over the app's current search index, rebuilt whenever the index is reloaded
+def get_typeahead(db_file=None):
+    global _typeahead
+    index = get_search_index(db_file)
+    if _typeahead is None or _typeahead.index is not index:
+        _typeahead = Typeahead(index)
+    return _typeahead
@@ -1,13 +1,59 @@
+import startup
 import dash
-from dash import dcc, html, Input, Output, State
-import sqlite3
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from dash import dcc, html, Input, Output, State, ALL
+import os
+from episode_query import (
+    RESULTS_PER_PAGE, build_filters, count_episodes, fetch_episode_page,
+    fetch_episodes_by_ids, fetch_filtered_ids
+)
+import db
+from cache import LRUCache
+from embeddings import get_embedding_index
+from episode_fields import format_air_date
+from episode_stats import get_episode_stats
+from fts_index import search_episodes
+from metrics import register_metrics_route, registry, stage, timed
+from startup import register_health_route
+from schema import create_schema, get_data_version
+from search_index import get_search_index
+from typeahead import get_typeahead
+from similar_episodes import fetch_similar_episodes, refresh_similar_episodes_in_background
+
+# pandas and scikit-learn are only imported by the code paths that use them, so the app starts
+# serving without them; the warm-up at the bottom of this file loads what searching needs
+startup.mark("imports")
 
 app = dash.Dash(__name__)
 app.title = "Episode Browser"
 
+# which ranker the search box uses: "tfidf" (prebuilt TF-IDF index), "fts" (SQLite FTS5 + bm25)
+# "typeahead" (prefix matching on the TF-IDF index, built for search-as-you-type)
+# or "semantic" (LSA embeddings with an approximate nearest-neighbor index, see embeddings.py)
+SEARCH_BACKEND = os.environ.get("EPISODES_SEARCH_BACKEND", "tfidf")
+
+# seconds the search box waits after the last keystroke before searching
+SEARCH_DEBOUNCE = 0.3
+
+# bring the database up to the current schema (ISO dates, integer votes, indexes, FTS table);
+# this and the similar-episodes refresh are the app's only writes, everything else reads through
+# the read-only connection pool in db.py (set EPISODES_DB to choose the database)
+create_schema(db.DB_FILE)
+startup.mark("schema")
+
+# result lists per filter combination and rendered cards per episode; both are keyed on the
+# data version, so anything cached before the last scrape is never served
+results_cache = LRUCache(maxsize=256, ttl=600)
+card_cache = LRUCache(maxsize=2048, ttl=600)
+
+# latency histograms of the callbacks below and the cache counters, served at /metrics;
+# readiness and the startup breakdown at /healthz
+register_metrics_route(app.server)
+register_health_route(app.server)
+registry.gauge("episodes_results_cache_hits", "Result list cache hits", lambda: results_cache.hits)
+registry.gauge("episodes_results_cache_misses", "Result list cache misses", lambda: results_cache.misses)
+registry.gauge("episodes_card_cache_hits", "Episode card cache hits", lambda: card_cache.hits)
+registry.gauge("episodes_card_cache_misses", "Episode card cache misses", lambda: card_cache.misses)
+
 
 # =========================
 # Helper Functions
@@ -15,37 +61,38 @@ app.title = "Episode Browser"
 
 # the main function used to fetch data from the database
 def fetch_data_from_db(filters=None, params=None):
-    conn = sqlite3.connect("episodes.db")
+    import pandas as pd
+
     query = "SELECT * FROM episodes"
     if filters:
         query += f" WHERE {filters}"
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn, params=params)
 
-# this function will format the votes to be more readable
+# this function will format the votes to be more readable, e.g. 4700 -> 4.7K
 def format_votes(vote):
     try:
-        if isinstance(vote, float) and vote >= 1000:
-            return f"{int(vote // 1000)}K"
-        elif isinstance(vote, float) and vote <= 100:
-            return f"{int(vote)}K"
-        else:
-            return int(vote)
-    except Exception:
+        vote = int(vote)
+    except (TypeError, ValueError):
         return vote
+    for limit, suffix in ((1000000, 'M'), (1000, 'K')):
+        if vote >= limit:
+            return f"{vote / limit:.1f}".rstrip('0').rstrip('.') + suffix
+    return vote
 
 
 # this function will find similar plots based on the input plot and show name
-def find_similar_plots(database_path="episodes.db", input_plot='', show_name='', plot_id=None, top_n=3):
-    conn = sqlite3.connect(database_path)
+def find_similar_plots(database_path=None, input_plot='', show_name='', plot_id=None, top_n=3):
+    import pandas as pd
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
 
     query = """
         SELECT * FROM episodes
         WHERE show = ?
     """
-    plots_df = pd.read_sql_query(query, conn, params=(show_name,))
-    conn.close()
+    with db.connection(database_path) as conn:
+        plots_df = pd.read_sql_query(query, conn, params=(show_name,))
 
     all_plots = plots_df['plot'].tolist()
     all_plots.insert(0, input_plot)  # Add input plot to the beginning
@@ -64,9 +111,9 @@ def find_similar_plots(database_path="episodes.db", input_plot='', show_name='',
     return most_similar_plots
 
 
-def create_similar_episodes_section(similar_df):
+def create_similar_episodes_section(similar_rows):
     suggestions = []
-    for _, sim_row in similar_df.iterrows():
+    for sim_row in similar_rows:
         suggestions.append(
             html.Div(
                 children=[
@@ -80,7 +127,7 @@ def create_similar_episodes_section(similar_df):
                         }
                     ),
                     html.P(
-                        f"Air Date: {sim_row['air_date']}",
+                        f"Air Date: {format_air_date(sim_row['air_date'])}",
                         style={
                             'color': '#7f8c8d',
                             'margin': '0 0 10px 0',
@@ -95,10 +142,6 @@ def create_similar_episodes_section(similar_df):
 
 
 def create_episode_card(row):
-    # Fetch similar episodes
-    similar_episodes_df = find_similar_plots(input_plot=row['plot'], show_name=row['show'], plot_id=row['id'])
-    suggestions = create_similar_episodes_section(similar_episodes_df)
-
     card = html.Div(
         style={
             'border': '1px solid #dcdcdc',
@@ -137,7 +180,7 @@ def create_episode_card(row):
                                         style={'color': '#7f8c8d', 'margin': '5px 0'}
                                     ),
                                     html.P(
-                                        f"Air Date: {row['air_date']}",
+                                        f"Air Date: {format_air_date(row['air_date'])}",
                                         style={'color': '#7f8c8d', 'margin': '5px 0'}
                                     ),
                                     html.P(
@@ -162,11 +205,14 @@ def create_episode_card(row):
                             )
                         ]
                     ),
-                    # Right column: suggestions
+                    # Right column: suggestions, filled in by load_similar_episodes after the card is shown
                     html.Div(
                         children=[
                             html.H4("Similar Episodes", style={'color': '#2c3e50', 'margin': '0 0 10px 0'}),
-                            *suggestions
+                            html.Div(
+                                id={'type': 'similar-episodes', 'index': int(row['id'])},
+                                children=html.P("Loading...", style={'color': '#7f8c8d', 'fontSize': '12px'})
+                            ),
                         ],
                         style={'flex': '1', 'marginLeft': '20px'}
                     ),
@@ -206,6 +252,7 @@ app.layout = html.Div(
                     id='search-title',
                     type='text',
                     placeholder='Enter keyword...',
+                    debounce=SEARCH_DEBOUNCE,
                     style={
                         'width': '500px',
                         'fontSize': '16px',
@@ -238,13 +285,10 @@ app.layout = html.Div(
                     },
                     children=[
                         html.Label("Filter by Show:", style={'fontSize': '16px'}),
+                        # the shows and their episode counts come from the summary table, see update_show_options
                         dcc.Dropdown(
                             id='filter-show',
-                            options=[
-                                {'label': 'Family Guy', 'value': 'Family Guy'},
-                                {'label': 'South Park', 'value': 'South Park'},
-                                {'label': 'The Simpsons', 'value': 'The Simpsons'},
-                            ],
+                            options=[],
                             placeholder="Select a show",
                             style={
                                 'height': '40px',
@@ -345,8 +389,15 @@ app.layout = html.Div(
             ]
         ),
 
+        # episode count and ratings of everything the filters match
+        html.Div(
+            id='filter-summary',
+            style={'textAlign': 'center', 'color': '#7f8c8d', 'marginBottom': '20px'}
+        ),
+
         html.Div(id='results-container', style={'display': 'block'}),
-        html.Div(id='current-page', style={'display': 'none'})
+        html.Div(id='current-page', style={'display': 'none'}),
+        html.Div(id='result-count', style={'display': 'none'})
     ]
 )
 
@@ -365,9 +416,11 @@ app.layout = html.Div(
     Input('filter-date', 'end_date'),
     Input('filter-rating', 'value'),
     Input('filter-season', 'value'),
-    State('current-page', 'children')
+    State('current-page', 'children'),
+    State('result-count', 'children')
 )
-def update_page_number(prev_clicks, next_clicks, search_title, filter_show, start_date, end_date, filter_rating, filter_season, current_page):
+@timed("update_page_number")
+def update_page_number(prev_clicks, next_clicks, search_title, filter_show, start_date, end_date, filter_rating, filter_season, current_page, result_count):
     if current_page is None:
         current_page = 1
 
@@ -385,21 +438,18 @@ def update_page_number(prev_clicks, next_clicks, search_title, filter_show, star
     if trigger_id == 'prev-page' and current_page > 1:
         current_page -= 1
     elif trigger_id == 'next-page':
-        current_page += 1
+        # don't page past the last page of results
+        if result_count is None or current_page * RESULTS_PER_PAGE < int(result_count):
+            current_page += 1
 
     return current_page
 
 
-@app.callback(
-    Output('page-number', 'children'),
-    Input('current-page', 'children')
-)
-def display_page_number(current_page):
-    return f"Page {current_page}" if current_page else "Page 1"
-
-
 @app.callback(
     Output('results-container', 'children'),
+    Output('page-number', 'children'),
+    Output('result-count', 'children'),
+    Output('filter-summary', 'children'),
     Input('search-title', 'value'),
     Input('filter-show', 'value'),
     Input('filter-date', 'start_date'),
@@ -408,70 +458,223 @@ def display_page_number(current_page):
     Input('current-page', 'children'),
     Input('filter-season', 'value')
 )
+@timed("update_results")
 def update_results(search_title, filter_show, start_date, end_date, filter_rating, current_page, filter_season):
-    filters = []
-    params = []
-
     # Build filters based on inputs
-    if filter_show:
-        filters.append("show = ?")
-        params.append(filter_show)
-
-    if start_date and end_date:
-        filters.append("air_date BETWEEN ? AND ?")
-        params += [start_date, end_date]
+    where_clause, params = build_filters(filter_show, start_date, end_date, filter_rating, filter_season)
 
-    if filter_rating is not None:
-        filters.append("rating >= ?")
-        params.append(filter_rating)
+    if not current_page:
+        current_page = 1
+    current_page = int(current_page)
 
-    if filter_season is not None:
-        filters.append("season = ?")
-        params.append(filter_season)
+    with stage("query"), db.connection() as conn:
+        data_version = get_data_version(conn)
 
-    where_clause = " AND ".join(filters) if filters else None
+    # counts and ratings of the filtered episodes from the summary table; None for filters it can't
+    # answer (a date range that doesn't cover whole years, a min rating between histogram buckets)
+    with stage("stats"):
+        summary = get_episode_stats().summary(filter_show, start_date, end_date, filter_rating, filter_season)
 
-    if not current_page:
-        current_page = 1
+    filtered_total = summary['episodes'] if summary is not None else None
+    page_ids, total, matches = find_page_ids(
+        search_title, where_clause, params, current_page, data_version, filtered_total
+    )
+    cards = render_cards(page_ids, data_version)
+
+    total_pages = max(1, -(-total // RESULTS_PER_PAGE))
+    page_label = f"Page {current_page} of {total_pages} ({total} episodes)"
+    return cards, page_label, total, format_summary(summary, matches)
+
+
+# "1,234 episodes, mean rating 7.4 (4.1 to 9.6), 1.2M votes"; with a search, "56 matches among ..."
+def format_summary(summary, matches=None):
+    if summary is None:
+        return None
+    text = f"{summary['episodes']:,} episodes"
+    if matches is not None:
+        text = f"{matches:,} matches among {text}"
+    if summary['mean_rating'] is not None:
+        text += f", mean rating {summary['mean_rating']:.1f} ({summary['min_rating']} to {summary['max_rating']})"
+    if summary['votes'] is not None:
+        text += f", {format_votes(summary['votes'])} votes"
+    return text
+
+
+# Show options with the number of episodes each has under the other filters
+#
+# read from the summary table, so shows added to the scraper appear after their first scrape
+@app.callback(
+    Output('filter-show', 'options'),
+    Input('filter-date', 'start_date'),
+    Input('filter-date', 'end_date'),
+    Input('filter-rating', 'value'),
+    Input('filter-season', 'value')
+)
+@timed("update_show_options")
+def update_show_options(start_date, end_date, filter_rating, filter_season):
+    with stage("stats"):
+        stats = get_episode_stats()
+        counts = stats.counts_by_show(start_date, end_date, filter_rating, filter_season)
+
+    if counts is None:
+        # filters the summary can't count (see update_results), so the shows are listed without counts
+        return [{'label': show, 'value': show} for show in stats.shows()]
+    return [{'label': f"{show} ({counts[show]})", 'value': show} for show in stats.shows()]
+
+
+# the episode ids on one page of results, the total number of results and, with a search, how many
+# of them match it (the TF-IDF ranking also lists episodes that share no word with the query)
+#
+# filtered_total is the number of episodes matching the filters when the summary table knows it,
+# which saves counting them in SQLite
+def find_page_ids(search_title, where_clause, params, current_page, data_version, filtered_total=None):
+    # a TF-IDF, typeahead or semantic search ranks every match at once, so later pages are just a slice
+    ranker = None
+    if search_title and SEARCH_BACKEND != "fts":
+        if SEARCH_BACKEND == "typeahead":
+            ranker = get_typeahead()
+        elif SEARCH_BACKEND == "semantic":
+            ranker = get_embedding_index()
+        else:
+            ranker = get_search_index()
 
-    # Fetch all relevant data
-    df = fetch_data_from_db(where_clause, params)
+    # the data version changes as soon as the scraper writes, but the ranker only once its index
+    # is republished; keyed on both, rankings from the old index are not kept once the new one is in
+    cache_key = (
+        data_version, SEARCH_BACKEND, ranker.version if ranker is not None else None,
+        search_title or None, where_clause, tuple(params)
+    )
+    results = results_cache.get(cache_key)
+    if results is None:
+        results = {'ranked_ids': None, 'total': None, 'matches': None, 'pages': {}}
+
+        if ranker is not None:
+            # the filters are applied by SQLite, so only the matching ids are ranked
+            with stage("query"):
+                candidate_ids = fetch_filtered_ids(where_clause, params)
+            with stage("rank"):
+                ranked_ids, scores = ranker.rank(search_title, candidate_ids)
+            results['ranked_ids'] = ranked_ids.tolist()
+            results['total'] = len(ranked_ids)
+            results['matches'] = int((scores > 0).sum())
+        results_cache.set(cache_key, results)
+
+    start_idx = (current_page - 1) * RESULTS_PER_PAGE
+    if results['ranked_ids'] is not None:
+        page_ids = results['ranked_ids'][start_idx:start_idx + RESULTS_PER_PAGE]
+        return page_ids, results['total'], results['matches']
+
+    if current_page not in results['pages']:
+        # With the FTS backend, SQLite ranks, filters and slices the page in one query
+        if search_title:
+            with stage("rank"):
+                page_ids, total = search_episodes(search_title, where_clause, params, RESULTS_PER_PAGE, start_idx)
+
+        # if there is no search_title, SQLite sorts by show, season, episode and slices the page
+        else:
+            with stage("query"):
+                total = results['total']
+                if total is None:
+                    total = filtered_total
+                if total is None:
+                    total = count_episodes(where_clause, params)
+                page = fetch_episode_page(where_clause, params, current_page, RESULTS_PER_PAGE, columns=['id'])
+                page_ids = [row['id'] for row in page]
+
+        results['total'] = total
+        # every FTS result contains the query
+        if search_title:
+            results['matches'] = total
+        results['pages'][current_page] = page_ids
+    return results['pages'][current_page], results['total'], results['matches']
+
+
+# cards for the given episodes, in order; only episodes without a cached card are loaded and rendered
+def render_cards(page_ids, data_version):
+    cards = {episode_id: card_cache.get((data_version, episode_id)) for episode_id in page_ids}
+    missing = [episode_id for episode_id, card in cards.items() if card is None]
+
+    if missing:
+        with stage("query"):
+            rows = fetch_episodes_by_ids(missing)
+
+        with stage("render"):
+            # only the rows that are shown get formatted
+            for row in rows:
+                row['votes'] = format_votes(row['votes'])
+
+            for row in rows:
+                cards[row['id']] = create_episode_card(row)
+                card_cache.set((data_version, row['id']), cards[row['id']])
+
+    return [cards[episode_id] for episode_id in page_ids if cards[episode_id] is not None]
+
+
+# Similar episodes for every card on the page, in one batched callback
+#
+# the cards are rendered without them, so the results show up right away; this runs as a separate
+# request once the cards are on the page and does one indexed lookup for all of them
+@app.callback(
+    Output({'type': 'similar-episodes', 'index': ALL}, 'children'),
+    Input({'type': 'similar-episodes', 'index': ALL}, 'id')
+)
+@timed("load_similar_episodes")
+def load_similar_episodes(panel_ids):
+    episode_ids = [panel_id['index'] for panel_id in panel_ids]
+    with stage("similar"):
+        similar = fetch_similar_episodes(episode_ids)
+
+    # new episodes get their neighbors from a background refresh; this request doesn't wait for it
+    refresh_similar_episodes_in_background(db.DB_FILE)
+
+    with stage("render"):
+        return [
+            create_similar_episodes_section(similar[episode_id])
+            or html.P("No similar episodes yet", style={'color': '#7f8c8d', 'fontSize': '12px'})
+            for episode_id in episode_ids
+        ]
 
-    if 'votes' in df.columns:
-        df['votes'] = df['votes'].apply(format_votes)
 
-    # If a search_title is given, apply TF-IDF search
-    if search_title and not df.empty:
+# =========================
+# Warm-up
+# =========================
 
-        # first we combine title and plot into a single text field for searching
-        df['text_for_search'] = df['episode_title'].fillna('') + ' ' + df['plot'].fillna('')
+# the neighbors of new episodes, on the same worker the callback above uses
+def warm_up_similar_episodes():
+    future = refresh_similar_episodes_in_background(db.DB_FILE)
+    if future is not None:
+        future.result()
+
+
+# load the search backend (and with it scikit-learn) and run one query through it
+def warm_up_search():
+    if SEARCH_BACKEND == "fts":
+        search_episodes("episode")
+        return
+    if SEARCH_BACKEND == "typeahead":
+        ranker = get_typeahead()
+    elif SEARCH_BACKEND == "semantic":
+        ranker = get_embedding_index()
+    else:
+        ranker = get_search_index()
+    ranker.rank("episode")
 
-        # then we vectorize all episodes + the query
-        all_docs = df['text_for_search'].tolist()
-        vectorizer = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = vectorizer.fit_transform(all_docs)
-        query_vec = vectorizer.transform([search_title])
 
-        # Compute similarity
-        similarities = cosine_similarity(query_vec, tfidf_matrix).flatten()
-        df['similarity'] = similarities
+# the first page everyone lands on, into the result and card caches
+def warm_up_first_page():
+    with db.connection() as conn:
+        data_version = get_data_version(conn)
+    page_ids, _, _ = find_page_ids(None, None, [], 1, data_version, get_episode_stats().count())
+    render_cards(page_ids, data_version)
 
-        # Sort by similarity
-        df = df.sort_values('similarity', ascending=False)
 
-    else:
-        # if there is no search_title, sort by show, season, episode
-        df = df.sort_values(['show', 'season', 'episode'], ascending=[True, True, True])
-
-    # Pagination
-    results_per_page = 10
-    start_idx = (int(current_page) - 1) * results_per_page
-    end_idx = start_idx + results_per_page
-    df_page = df.iloc[start_idx:end_idx]
-
-    # Create cards
-    cards = [create_episode_card(row) for _, row in df_page.iterrows()]
-    return cards
+startup.mark("layout and callbacks")
+startup.start_warm_up([
+    ("similar episodes", warm_up_similar_episodes),
+    ("search index", warm_up_search),
+    ("summary statistics", get_episode_stats),
+    ("first page", warm_up_first_page),
+])
 
 
 if __name__ == '__main__':